@@ -0,0 +1,53 @@
+"""
+Сравнение скорости qa_testlab.image_diff.compare_images и pixelmatch на синтетических скриншотах.
+Запуск: python benchmarks/image_diff_benchmark.py [ширина] [высота] [повторы]
+"""
+import sys
+from pathlib import Path
+from time import perf_counter
+
+from PIL import Image, ImageDraw
+from pixelmatch.contrib.PIL import pixelmatch
+
+# запуск из корня репозитория без установки пакета
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from qa_testlab.image_diff import compare_images  # noqa: E402
+
+
+def make_screenshot(width, height, text_offset=0):
+    image = Image.new('RGBA', (width, height), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for i in range(0, width, 120):
+        for j in range(0, height, 60):
+            draw.rectangle([i + 5, j + 5, i + 110, j + 50], outline=(40, 90, 200, 255), width=2)
+            draw.ellipse([i + 10, j + 10, i + 40, j + 40], fill=((i * 7) % 255, (j * 3) % 255, 120, 255))
+            draw.text((i + 50 + text_offset, j + 20), 'widget', fill=(0, 0, 0, 255))
+    return image
+
+
+def measure(name, func, repeats):
+    started = perf_counter()
+    for _ in range(repeats):
+        result = func()
+    elapsed = (perf_counter() - started) / repeats
+    print(f'{name:<40} {elapsed * 1000:>10.1f} мс  отличающихся пикселей: {result}')
+    return result
+
+
+def main():
+    args = [int(a) for a in sys.argv[1:4]]
+    width, height, repeats = args + [640, 360, 3][len(args):]
+    original = make_screenshot(width, height)
+    changed = make_screenshot(width, height, text_offset=1)
+    print(f'Изображения {width}x{height}, повторов: {repeats}')
+    for title, expected in (('одинаковые', original.copy()), ('с отличиями', changed)):
+        numpy_result = measure(f'numpy ({title})', lambda: compare_images(original, expected)[0], repeats)
+        pixelmatch_result = measure(
+            f'pixelmatch ({title})',
+            lambda: pixelmatch(original, expected, output=Image.new('RGBA', original.size), threshold=0.1),
+            repeats)
+        assert numpy_result == pixelmatch_result, f'Результаты не совпадают: {numpy_result} != {pixelmatch_result}'
+
+
+if __name__ == '__main__':
+    main()
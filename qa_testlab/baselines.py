@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image
+
+from qa_testlab import settings
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def pixel_hash(image: Image.Image) -> str:
+    """
+    Хэш содержимого изображения (размер и RGBA пиксели), не зависит от сжатия PNG
+    """
+    rgba = image.convert('RGBA')
+    content = hashlib.sha256(f'{rgba.size[0]}x{rgba.size[1]}'.encode())
+    content.update(rgba.tobytes())
+    return content.hexdigest()
+
+
+def perceptual_hash(image: Image.Image, size: int = 8) -> str:
+    """
+    Перцептивный хэш (dHash): сравнение яркости соседних пикселей уменьшенного изображения
+    """
+    gray = image.convert('L').resize((size + 1, size), Image.LANCZOS)
+    pixels = list(gray.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            bits = (bits << 1) | int(pixels[row * (size + 1) + col] > pixels[row * (size + 1) + col + 1])
+    return f'{bits:0{size * size // 4}x}'
+
+
+def hash_distance(first: str, second: str) -> int:
+    """
+    Количество отличающихся бит перцептивных хэшей
+    """
+    return bin(int(first, 16) ^ int(second, 16)).count('1')
+
+
+class BaselineStore:
+    """
+    Хранилище эталонных скриншотов: декодированные изображения хранятся в LRU кэше памяти, хэши содержимого файла,
+    пикселей и перцептивный хэш - в индексе на диске. Запись индекса обновляется при изменении размера или времени
+    изменения файла эталона.
+    """
+    def __init__(self, index_path, max_images: int = 32):
+        """
+        Args:
+            index_path: путь к файлу индекса хэшей
+            max_images (int): количество декодированных эталонов в памяти
+        """
+        self.index_path = Path(index_path)
+        self.max_images = max_images
+        self._images = OrderedDict()
+        self._index = None
+        self._attached = set()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _key(path):
+        stat = os.stat(path)
+        return str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(self.index_path) as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.index_path.with_name(f'{self.index_path.name}.{os.getpid()}.tmp')
+            with open(temp_path, 'w') as f:
+                json.dump(self._index, f, indent=2)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            settings.logger.warning(f'Не удалось сохранить индекс эталонных скриншотов: {e}')
+
+    def image(self, path) -> Image.Image:
+        """
+        Получает декодированный эталон из кэша памяти или с диска
+        """
+        key = self._key(path)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+        image = Image.open(path)
+        image.load()
+        with self._lock:
+            self._images[key] = image
+            while len(self._images) > self.max_images:
+                self._images.popitem(last=False)
+        return image
+
+    def info(self, path) -> dict:
+        """
+        Получает хэши эталона из индекса, при отсутствии или изменении файла вычисляет их заново
+        Returns: dict с ключами sha256 (хэш файла), pixel_hash, perceptual_hash, size ([ширина, высота])
+        """
+        name, mtime, size = self._key(path)
+        with self._lock:
+            entry = self._load_index().get(name)
+            if entry and entry['mtime'] == mtime and entry['file_size'] == size:
+                return entry
+            with open(path, 'rb') as f:
+                file_hash = hashlib.sha256(f.read()).hexdigest()
+            image = self.image(path)
+            entry = {'mtime': mtime, 'file_size': size, 'sha256': file_hash, 'pixel_hash': pixel_hash(image),
+                     'perceptual_hash': perceptual_hash(image), 'size': list(image.size)}
+            self._index[name] = entry
+            self._save_index()
+            return entry
+
+    def attach_once(self, path) -> bool:
+        """
+        Отмечает эталон как добавленный в отчёт
+        Returns: bool True - эталон ещё не добавлялся в отчёт в текущем запуске
+        """
+        key = self._key(path)
+        with self._lock:
+            if key in self._attached:
+                return False
+            self._attached.add(key)
+            return True
+
+
+def get_baseline_store() -> BaselineStore:
+    global _store
+    with _store_lock:
+        if not _store:
+            _store = BaselineStore(settings.baseline_index, max_images=settings.baseline_cache_size)
+        return _store
@@ -1,10 +1,30 @@
+import atexit
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import glob
+import hashlib
+import io
 import os
+import posixpath
+import re
+import select
+import shlex
+import shutil
+import signal
+import stat
 import subprocess
 import tarfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from time import sleep
+from time import monotonic, sleep
 
 import allure
+import paramiko
 from fsspec.implementations.local import LocalFileSystem
 from fsspec.implementations.sftp import SFTPFileSystem
 
@@ -12,6 +32,16 @@ from qa_testlab import settings
 
 logger = settings.logger
 
+_ssh_pool = None
+_ssh_pool_lock = threading.Lock()
+
+# размер блока чтения вывода команд
+_OUTPUT_CHUNK = 32768
+# количество байт перед позицией чтения лога, по которым определяется замена файла при ротации
+_LOG_FINGERPRINT_SIZE = 64
+# интервал опроса каталогов при ожидании файлов (в секундах): начальный, множитель и максимальный
+_POLL_MIN, _POLL_BACKOFF, _POLL_MAX = 0.1, 1.5, 2
+
 
 def get_fsspec(host=None, port=None, login=None, password=None):
     host = host if host else settings.host
@@ -19,8 +49,10 @@ def get_fsspec(host=None, port=None, login=None, password=None):
     login = login if login else settings.ssh_login
     password = password if password else settings.ssh_password
 
-    if settings.host in ('localhost', '0.0.0.0', '127.0.0.1') and int(port) == 22:
+    if host in ('localhost', '0.0.0.0', '127.0.0.1') and int(port) == 22:
         return LocalFileSystemWrapper()
+    elif settings.ssh_pool:
+        return get_ssh_pool().get(host, port, login, password)
     else:
         return SFTPFileSystemWrapper(
             host=host,
@@ -32,59 +64,824 @@ def get_fsspec(host=None, port=None, login=None, password=None):
         )
 
 
+class CommandResult:
+    """
+    Результат выполнения команды
+    """
+    def __init__(self, command, exit_code, stdout, stderr, duration, timed_out=False, truncated=False, host=None):
+        """
+        Args:
+            command: str выполненная команда
+            exit_code: int код завершения, None - команда не завершилась за отведённое время
+            stdout: str вывод команды
+            stderr: str вывод ошибок команды
+            duration: float время выполнения (в секундах)
+            timed_out: bool истёк таймаут выполнения
+            truncated: bool вывод превысил settings.command_output_limit, сохранено только его окончание
+            host: str хост, на котором выполнялась команда
+        """
+        self.command = command
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.timed_out = timed_out
+        self.truncated = truncated
+        self.host = host
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_code == 0
+
+    def __repr__(self):
+        return f'CommandResult(host={self.host!r}, command={self.command!r}, exit_code={self.exit_code}, ' \
+               f'duration={self.duration:.3f}, timed_out={self.timed_out})'
+
+
+class _OutputBuffer:
+    """
+    Буфер вывода команды ограниченного размера: при превышении limit байт сохраняется окончание вывода
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.size = 0
+        self.total = 0
+        self._chunks = deque()
+
+    def write(self, chunk: bytes):
+        self.total += len(chunk)
+        self.size += len(chunk)
+        self._chunks.append(chunk)
+        while self.limit and self.size > self.limit:
+            extra = self.size - self.limit
+            if len(self._chunks[0]) <= extra:
+                self.size -= len(self._chunks.popleft())
+            else:
+                self._chunks[0] = self._chunks[0][extra:]
+                self.size -= extra
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > self.size
+
+    def getvalue(self) -> str:
+        return b''.join(self._chunks).decode('utf-8', errors='replace')
+
+
+def _command_result(command, exit_code, stdout, stderr, started, timed_out, host=None) -> CommandResult:
+    return CommandResult(command, exit_code, stdout.getvalue(), stderr.getvalue(), monotonic() - started,
+                         timed_out=timed_out, truncated=stdout.truncated or stderr.truncated, host=host)
+
+
+def _legacy_run_result(result: CommandResult, status, output):
+    # результат run: код завершения, вывод команды (без завершающего перевода строки) или None
+    if output:
+        return result.stdout[:-1] if result.stdout.endswith('\n') else result.stdout
+    return result.exit_code if status else None
+
+
+def _wait_channel(channel, stdout: _OutputBuffer, stderr: _OutputBuffer, deadline=None):
+    """
+    Читает вывод канала до завершения команды без активного ожидания: поток блокируется на select по событию
+    поступления данных в канал
+    Returns: int код завершения или None, если истёк deadline
+    """
+    while True:
+        while channel.recv_ready():
+            stdout.write(channel.recv(_OUTPUT_CHUNK))
+        while channel.recv_stderr_ready():
+            stderr.write(channel.recv_stderr(_OUTPUT_CHUNK))
+        if channel.exit_status_ready() and (channel.eof_received or channel.closed):
+            if not channel.recv_ready() and not channel.recv_stderr_ready():
+                return channel.recv_exit_status()
+            continue
+        remaining = deadline - monotonic() if deadline else 1
+        if remaining <= 0:
+            return None
+        if channel.eof_received:
+            # вывод закрыт, но команда ещё выполняется: ожидание кода завершения
+            channel.status_event.wait(min(remaining, 1))
+        else:
+            select.select([channel], [], [], min(remaining, 1))
+
+
+def _pump(stream, buffer: _OutputBuffer):
+    for chunk in iter(lambda: stream.read1(_OUTPUT_CHUNK), b''):
+        buffer.write(chunk)
+    stream.close()
+
+
 class SFTPFileSystemWrapper(SFTPFileSystem):
-    def __init__(self, host, **ssh_kwargs):
+    def __init__(self, host, max_channels: int = None, **ssh_kwargs):
+        """
+        Args:
+            host: str адрес хоста
+            max_channels: int количество одновременно открытых каналов (команд) на соединение,
+                          по умолчанию settings.ssh_max_channels
+            ssh_kwargs: параметры подключения paramiko.SSHClient.connect
+        """
+        self._channels = threading.BoundedSemaphore(max_channels or settings.ssh_max_channels)
+        self._borrowed = 0
+        self._sftp_clients = []
+        self._state_lock = threading.Lock()
+        self._client = None
+        self._ftp = None
+        self._disconnected = True
+        self.last_used = monotonic()
         super().__init__(host, **ssh_kwargs)
 
-    def run(self, command, status=True, background=False, output=False):
+    def _connect(self):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(getattr(self, 'host_key_policy', None) or paramiko.AutoAddPolicy())
+        client.connect(self.host, **self.ssh_kwargs)
+        self._client, self._ftp = client, client.open_sftp()
+        self._disconnected = False
+
+    # методы fsspec (ls, info, open и т.д.) обращаются к client и ftp напрямую: соединение, закрытое пулом или
+    # методом close, восстанавливается при первом обращении
+    @property
+    def client(self) -> paramiko.SSHClient:
+        if self._disconnected:
+            self.ensure_connected()
+        self.last_used = monotonic()
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    @property
+    def ftp(self) -> paramiko.SFTPClient:
+        if self._disconnected:
+            self.ensure_connected()
+        self.last_used = monotonic()
+        return self._ftp
+
+    @ftp.setter
+    def ftp(self, value):
+        self._ftp = value
+
+    @property
+    def disconnected(self) -> bool:
+        return self._disconnected
+
+    @property
+    def borrowed(self) -> int:
+        """
+        Количество выданных в данный момент каналов
+        """
+        return self._borrowed
+
+    def is_alive(self) -> bool:
+        """
+        Проверяет, что SSH соединение установлено и отвечает
+        """
+        transport = self._client.get_transport() if self._client and not self._disconnected else None
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except (OSError, EOFError):
+            return False
+        return True
+
+    def ensure_connected(self):
+        """
+        Переподключается, если соединение разорвано или закрыто. Экземпляр остаётся прежним, поэтому использующие
+        его FSHandler продолжают работать без пересоздания.
+        """
+        with self._state_lock:
+            if self.is_alive():
+                return
+            logger.info(f'SSH соединение с {self.host} закрыто или разорвано, выполняется переподключение')
+            self.close()
+            self._connect()
+
+    def close(self):
+        """
+        Закрывает SSH соединение, при следующем обращении к файловой системе оно будет установлено заново
+        """
+        self._disconnected = True
+        self._sftp_clients = []
+        if self._client:
+            self._client.close()
+
+    @contextmanager
+    def channel(self, timeout: float = None):
+        """
+        Выдаёт SSH соединение для открытия канала с учётом ограничения max_channels
+        Args:
+            timeout: float время ожидания свободного канала (в секундах), None - без ограничения
+        """
+        if not self._channels.acquire(timeout=timeout):
+            raise TimeoutError(f'Нет свободного SSH канала к {self.host} в течение {timeout} сек.')
+        with self._state_lock:
+            self._borrowed += 1
+        try:
+            yield self.client
+        finally:
+            with self._state_lock:
+                self._borrowed -= 1
+                self.last_used = monotonic()
+            self._channels.release()
+
+    @contextmanager
+    def transfer_channel(self):
+        """
+        Выдаёт отдельный SFTP канал (paramiko.SFTPClient) для передачи файлов параллельно с другими потоками.
+        Открытые каналы переиспользуются, их количество ограничено max_channels.
+        """
+        with self.channel():
+            self.ensure_connected()
+            with self._state_lock:
+                sftp = self._sftp_clients.pop() if self._sftp_clients else None
+            if sftp is None or sftp.sock.closed:
+                sftp = self.client.open_sftp()
+            try:
+                yield sftp
+            except Exception:
+                sftp.close()
+                raise
+            with self._state_lock:
+                self._sftp_clients.append(sftp)
+
+    def execute(self, command, timeout: float = None, output_limit: int = None) -> CommandResult:
+        """
+        Выполняет команду и ожидает её завершения
+        Args:
+            command: str команда
+            timeout: float время ожидания завершения (в секундах), None - без ограничения. По истечении канал
+                     закрывается, exit_code результата None
+            output_limit: int размер сохраняемого вывода stdout и stderr (в байтах), по умолчанию
+                          settings.command_output_limit
+        Returns: CommandResult
+        """
+        limit = settings.command_output_limit if output_limit is None else output_limit
+        stdout, stderr = _OutputBuffer(limit), _OutputBuffer(limit)
+        started = monotonic()
+        with self.channel():
+            self.ensure_connected()
+            channel = self.client.get_transport().open_session()
+            try:
+                channel.exec_command(command)
+                exit_code = _wait_channel(channel, stdout, stderr, started + timeout if timeout else None)
+            finally:
+                channel.close()
+        return _command_result(command, exit_code, stdout, stderr, started, exit_code is None, host=self.host)
+
+    def run(self, command, status=True, background=False, output=False, timeout: float = None):
+        """
+        Выполняет команду
+        Returns: int код завершения (status=True), str вывод команды (output=True) или None
+        """
         if background:
             command += ' > /dev/null 2>&1 &'
-        stdin, stdout, stderr = self.client.exec_command(command)
         if not status and not output:
-            sleep(0.5)
+            with self.channel():
+                self.client.exec_command(command)
+                sleep(0.5)
             return
-        while not stdout.channel.exit_status_ready():
-            pass
-        if not output:
-            return stdout.channel.exit_status
-        else:
-            return stdout.readline()
+        return _legacy_run_result(self.execute(command, timeout=timeout), status, output)
+
+
+class SSHConnectionPool:
+    """
+    Пул SSH/SFTP соединений процесса. Соединение создаётся один раз для сочетания хост/порт/пользователь и
+    выдаётся всем вызовам get_fsspec, перед выдачей проверяется его работоспособность. SSH соединения без выданных
+    каналов, не использовавшиеся дольше idle_timeout, закрываются, при этом экземпляр файловой системы остаётся
+    в пуле и у использующих его FSHandler, а соединение восстанавливается при следующем обращении.
+    """
+    def __init__(self, max_channels: int = 8, idle_timeout: float = 300):
+        """
+        Args:
+            max_channels (int): количество одновременно открытых каналов на соединение
+            idle_timeout (float): время (в секундах), после которого неиспользуемое SSH соединение закрывается
+        """
+        self.max_channels = max_channels
+        self.idle_timeout = idle_timeout
+        self._connections = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def _evict_idle(self):
+        now = monotonic()
+        with self._lock:
+            idle = [fs for fs in self._connections.values() if self.idle_timeout and not fs.disconnected
+                    and not fs.borrowed and now - fs.last_used > self.idle_timeout]
+        for fs in idle:
+            logger.info(f'закрывается неиспользуемое SSH соединение с {fs.host}')
+            fs.close()
+
+    def get(self, host, port, username, password) -> SFTPFileSystemWrapper:
+        """
+        Выдаёт соединение из пула, создаёт новое при отсутствии и переподключается при разрыве
+        Returns: SFTPFileSystemWrapper
+        """
+        self._evict_idle()
+        key = (host, int(port), username)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # соединение с хостом создаётся одним потоком, подключение к другим хостам не блокируется
+        with key_lock:
+            with self._lock:
+                fs = self._connections.get(key)
+            if fs is None:
+                fs = SFTPFileSystemWrapper(
+                    host=host,
+                    port=int(port),
+                    username=username,
+                    password=password,
+                    look_for_keys=False,
+                    allow_agent=False,
+                    max_channels=self.max_channels,
+                    skip_instance_cache=True
+                )
+                with self._lock:
+                    self._connections[key] = fs
+                logger.info(f'установлено SSH соединение с {username}@{host}:{port}')
+            else:
+                fs.ensure_connected()
+            fs.last_used = monotonic()
+            return fs
+
+    def close_all(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for fs in connections:
+            fs.close()
+
+
+def get_ssh_pool() -> SSHConnectionPool:
+    global _ssh_pool
+    with _ssh_pool_lock:
+        if not _ssh_pool:
+            _ssh_pool = SSHConnectionPool(max_channels=settings.ssh_max_channels,
+                                          idle_timeout=settings.ssh_idle_timeout)
+        return _ssh_pool
+
+
+def close_ssh_connections():
+    if _ssh_pool:
+        _ssh_pool.close_all()
+
+
+atexit.register(close_ssh_connections)
 
 
 class LocalFileSystemWrapper(LocalFileSystem):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-    def run(self, command, status=True, background=False, output=False):
+    @contextmanager
+    def channel(self, timeout: float = None):
+        yield None
+
+    @contextmanager
+    def transfer_channel(self):
+        yield _LocalTransferChannel
+
+    def execute(self, command, timeout: float = None, output_limit: int = None) -> CommandResult:
+        """
+        Выполняет команду и ожидает её завершения, интерфейс аналогичен SFTPFileSystemWrapper.execute. По истечении
+        timeout процесс завершается.
+        Returns: CommandResult
+        """
+        return self._execute(command, timeout, output_limit)
+
+    def _execute(self, command, timeout: float = None, output_limit: int = None, merge_stderr: bool = False):
+        """
+        Args:
+            merge_stderr: bool stderr объединяется с stdout в порядке вывода (как subprocess.getstatusoutput)
+        """
+        limit = settings.command_output_limit if output_limit is None else output_limit
+        stdout, stderr = _OutputBuffer(limit), _OutputBuffer(limit)
+        started = monotonic()
+        # отдельная группа процессов, чтобы по таймауту завершить и дочерние процессы команды
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+                                   start_new_session=True)
+        readers = [threading.Thread(target=_pump, args=(process.stdout, stdout), daemon=True)]
+        if not merge_stderr:
+            readers.append(threading.Thread(target=_pump, args=(process.stderr, stderr), daemon=True))
+        for reader in readers:
+            reader.start()
+        try:
+            exit_code = process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+            exit_code = None
+        for reader in readers:
+            # вывод фоновых процессов команды может оставаться открытым после её завершения
+            reader.join(1)
+        return _command_result(command, exit_code, stdout, stderr, started, exit_code is None, host='localhost')
+
+    def run(self, command, status=True, background=False, output=False, timeout: float = None):
+        """
+        Выполняет команду
+        Returns: int код завершения (status=True), str вывод команды вместе с выводом ошибок (output=True) или None
+        """
         if background:
             command += ' > /dev/null 2>&1 &'
-        s = subprocess.s = subprocess.getstatusoutput(command)
-        if not output:
-            return s[0] if status else None
-        else:
-            return s[1]
+        return _legacy_run_result(self._execute(command, timeout=timeout, merge_stderr=output), status, output)
+
+
+def _connection_key(fs) -> tuple:
+    """
+    Ключ подключения файловой системы: (хост, порт, пользователь), для локальной файловой системы ('localhost', None,
+    None)
+    """
+    ssh_kwargs = getattr(fs, 'ssh_kwargs', {})
+    return getattr(fs, 'host', 'localhost'), ssh_kwargs.get('port'), ssh_kwargs.get('username')
+
+
+def _execute_calls(calls: list, max_workers: int = None, timeout: float = None) -> list:
+    """
+    Параллельно выполняет команды, см. execute_batch
+    Returns: список пар (ключ подключения, CommandResult) в порядке calls
+    """
+    def execute(call):
+        target, command = call
+        fs = target.fsspec if isinstance(target, FSHandler) else target
+        key = _connection_key(fs)
+        started = monotonic()
+        try:
+            return key, fs.execute(command, timeout=timeout)
+        except Exception as e:
+            logger.error(f'\tошибка выполнения команды "{command}" на {key[0]}: {e}')
+            return key, CommandResult(command, None, '', str(e), monotonic() - started, host=key[0])
+
+    started = monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers if max_workers else settings.command_workers) as executor:
+        results = list(executor.map(execute, calls))
+    by_key = {}
+    for key, result in results:
+        by_key.setdefault(key, []).append(result)
+    summary = '\n'.join(f'- {host}:{port} ({user}): успешно {sum(r.ok for r in key_results)} из {len(key_results)}, '
+                        f'{max(r.duration for r in key_results):.3f} сек.'
+                        for (host, port, user), key_results in by_key.items())
+    logger.info(f'Выполнено {len(results)} команд на {len(by_key)} хостах за {monotonic() - started:.3f} сек.:\n'
+                f'{summary}')
+    return results
+
+
+def execute_batch(calls: list, max_workers: int = None, timeout: float = None) -> dict:
+    """
+    Параллельно выполняет команды на нескольких хостах. Команды одного хоста выполняются в отдельных каналах общего
+    соединения из пула (не более settings.ssh_max_channels одновременно на соединение). Ошибка подключения или
+    выполнения на одном хосте не прерывает выполнение на остальных, а возвращается в результате.
+    Args:
+        calls: list кортежей (файловая система get_fsspec или FSHandler, команда), например
+            [(get_fsspec('10.0.0.1'), 'systemctl restart app'), (get_fsspec('10.0.0.2'), 'systemctl restart app')]
+        max_workers: int количество одновременно выполняемых команд, по умолчанию settings.command_workers
+        timeout: float время ожидания завершения каждой команды (в секундах), None - без ограничения
+    Returns: dict {(хост, порт, пользователь): список CommandResult в порядке calls}, подключения к одному хосту с
+        разными портами или пользователями не объединяются
+    """
+    by_key = {}
+    for key, result in _execute_calls(calls, max_workers=max_workers, timeout=timeout):
+        by_key.setdefault(key, []).append(result)
+    return by_key
+
+
+def _is_not_empty_error(channel, path, error: OSError) -> bool:
+    """
+    Ошибка удаления каталога вызвана тем, что он не пуст: ENOTEMPTY/EEXIST локально, общая ошибка SFTP (без errno)
+    для каталога с содержимым. Ошибки доступа и прочие ошибки не считаются.
+    """
+    if error.errno in (errno.ENOTEMPTY, errno.EEXIST):
+        return True
+    if error.errno is None:
+        try:
+            return len(channel.listdir(path)) > 0
+        except OSError:
+            return False
+    return False
+
+
+class _LocalTransferChannel:
+    """
+    Операции локальной файловой системы с интерфейсом paramiko.SFTPClient (put, get, mkdir, utime, listdir, stat,
+    remove, rmdir)
+    """
+    put = staticmethod(shutil.copyfile)
+    get = staticmethod(shutil.copyfile)
+    mkdir = staticmethod(os.mkdir)
+    utime = staticmethod(os.utime)
+    listdir = staticmethod(os.listdir)
+    stat = staticmethod(os.stat)
+    remove = staticmethod(os.remove)
+    rmdir = staticmethod(os.rmdir)
+
+
+class _Inotify:
+    """
+    Ожидание создания файлов в локальных каталогах через inotify (Linux) без периодического опроса
+    """
+    _MASK = 0x100 | 0x80  # IN_CREATE | IN_MOVED_TO
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self._watched = set()
+
+    @classmethod
+    def create(cls):
+        """
+        Returns: _Inotify или None, если inotify недоступен
+        """
+        try:
+            return cls()
+        except (OSError, AttributeError, TypeError):
+            return None
+
+    def watch(self, path):
+        if path not in self._watched and self._libc.inotify_add_watch(self.fd, os.fsencode(path), self._MASK) >= 0:
+            self._watched.add(path)
+
+    def wait(self, timeout: float):
+        if select.select([self.fd], [], [], timeout)[0]:
+            try:
+                while os.read(self.fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def _local_tree(root):
+    """
+    Обходит локальный каталог один раз
+    Returns: tuple (список относительных путей каталогов, dict {относительный путь файла: (размер, mtime)})
+    """
+    dirs, files = [], {}
+    stack = ['']
+    while stack:
+        relative = stack.pop()
+        with os.scandir(os.path.join(root, relative)) as entries:
+            for entry in entries:
+                item = f'{relative}/{entry.name}' if relative else entry.name
+                if entry.is_dir():
+                    dirs.append(item)
+                    stack.append(item)
+                else:
+                    info = entry.stat()
+                    files[item] = (info.st_size, info.st_mtime)
+    return dirs, files
+
+
+def _fs_tree(fs, root):
+    """
+    Обходит каталог файловой системы get_fsspec одним подробным листингом (listdir_attr) на каталог, без запроса
+    stat на каждый файл
+    Returns: tuple (список относительных путей каталогов, dict {относительный путь файла: (размер, mtime)})
+    """
+    if isinstance(fs, LocalFileSystem):
+        return _local_tree(root)
+    dirs, files = [], {}
+    stack = ['']
+    with fs.transfer_channel() as sftp:
+        while stack:
+            relative = stack.pop()
+            for attr in sftp.listdir_attr(posixpath.join(root, relative)):
+                item = f'{relative}/{attr.filename}' if relative else attr.filename
+                if stat.S_ISDIR(attr.st_mode):
+                    dirs.append(item)
+                    stack.append(item)
+                else:
+                    files[item] = (attr.st_size, attr.st_mtime)
+    return dirs, files
+
+
+def _fs_hashes(fs, root) -> dict:
+    """
+    Вычисляет sha256 всех файлов каталога одной командой на стороне файловой системы
+    Returns: dict {относительный путь файла: sha256}
+    """
+    result = fs.execute(f'cd {shlex.quote(str(root))} && find . -type f -exec sha256sum {{}} +')
+    hashes = {}
+    for line in result.stdout.splitlines():
+        file_hash, _, path = line.partition('  ')
+        hashes[path[2:]] = file_hash
+    return hashes
+
+
+def _local_hash(path) -> str:
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _archive_members(tar, pattern=None, max_member_size=None, encoding='utf-8'):
+    for member in tar:
+        if not member.isfile() or pattern and not fnmatch.fnmatch(member.name, pattern):
+            continue
+        if max_member_size is not None and member.size > max_member_size:
+            logger.info(f'файл архива {member.name} пропущен: размер {member.size} байт')
+            continue
+        data = tar.extractfile(member).read()
+        try:
+            data = data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+        yield {'name': member.name, 'size': member.size, 'data': data}
+
+
+def _archive_entry(member) -> str:
+    if isinstance(member['data'], bytes):
+        return f'файл "{member["name"]}": <бинарные данные, {member["size"]} байт>'
+    return f'файл "{member["name"]}": {member["data"]}'
 
 
 class FSHandler:
     def __init__(self, fsspec):
         self.fsspec = fsspec
+        self._log_positions = {}
 
     @allure.step('Получает данные из файла {filepath}')
     def get_data_from_file(self, filepath):
-        return self.fsspec.cat_file(filepath).decode('utf-8').splitlines(True)
+        return list(self.read_lines(filepath))
+
+    def read_lines(self, filepath, chunk_size: int = 1024 * 1024, encoding: str = 'utf-8'):
+        """
+        Построчно читает файл блоками по chunk_size байт, в памяти находится только текущий блок
+        Args:
+            filepath: str путь к файлу
+            chunk_size: int размер блока чтения (в байтах)
+            encoding: str кодировка файла
+        Returns: генератор строк файла (с завершающим переводом строки)
+        """
+        with self.fsspec.open(filepath, 'rb', block_size=chunk_size) as f:
+            rest = b''
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                lines = (rest + chunk).split(b'\n')
+                rest = lines.pop()
+                for line in lines:
+                    yield f'{line.decode(encoding, errors="replace")}\n'
+            if rest:
+                yield rest.decode(encoding, errors='replace')
+
+    @allure.step('Получает последние {n} строк файла {filepath}')
+    def tail(self, filepath, n: int = 10, chunk_size: int = 64 * 1024, encoding: str = 'utf-8') -> list:
+        """
+        Читает последние n строк файла блоками с конца файла, не читая файл целиком
+        Args:
+            filepath: str путь к файлу
+            n: int количество строк
+            chunk_size: int размер блока чтения (в байтах)
+            encoding: str кодировка файла
+        Returns: list строк (с завершающим переводом строки)
+        """
+        if n <= 0:
+            return []
+        with self.fsspec.open(filepath, 'rb', block_size=chunk_size) as f:
+            f.seek(0, os.SEEK_END)
+            position = f.tell()
+            data = b''
+            # n + 1 перевод строки гарантирует, что первая из n строк прочитана полностью
+            while position > 0 and data.count(b'\n') <= n:
+                size = min(chunk_size, position)
+                position -= size
+                f.seek(position)
+                data = f.read(size) + data
+        return [line.decode(encoding, errors='replace') for line in io.BytesIO(data).readlines()[-n:]]
+
+    def grep(self, filepath, pattern, chunk_size: int = 1024 * 1024, encoding: str = 'utf-8'):
+        """
+        Построчно читает файл и возвращает строки, соответствующие регулярному выражению
+        Args:
+            filepath: str путь к файлу
+            pattern: str или re.Pattern регулярное выражение
+            chunk_size: int размер блока чтения (в байтах)
+            encoding: str кодировка файла
+        Returns: генератор найденных строк
+        """
+        regex = re.compile(pattern)
+        return (line for line in self.read_lines(filepath, chunk_size, encoding) if regex.search(line))
+
+    def follow_log(self, filepath, from_start: bool = False):
+        """
+        Запоминает позицию в файле лога, с которой read_new_lines и wait_for_log_line читают добавленные строки.
+        Вызывается перед действием, результат которого проверяется по логу.
+        Args:
+            filepath: str путь к файлу лога
+            from_start: bool читать файл с начала, иначе - только строки, добавленные после вызова
+        """
+        position = {'offset': 0, 'inode': None, 'fingerprint': b'', 'pending': []}
+        self._log_positions[filepath] = position
+        if from_start:
+            return
+        try:
+            info = self.fsspec.info(filepath)
+        except FileNotFoundError:
+            return
+        position.update(offset=info['size'], inode=info.get('ino'))
+        if info['size']:
+            with self.fsspec.open(filepath, 'rb') as f:
+                f.seek(max(info['size'] - _LOG_FINGERPRINT_SIZE, 0))
+                position['fingerprint'] = f.read(info['size'] - f.tell())
+
+    def read_new_lines(self, filepath, encoding: str = 'utf-8') -> list:
+        """
+        Читает полные строки, добавленные в файл лога после предыдущего чтения (или вызова follow_log). Читаются только
+        новые байты файла. Ротация и усечение файла определяются по смене inode (на локальной файловой системе),
+        уменьшению размера или изменению байт перед позицией чтения, после чего файл читается с начала.
+        Args:
+            filepath: str путь к файлу лога
+            encoding: str кодировка файла
+        Returns: list новых строк (с завершающим переводом строки)
+        """
+        position = self._log_positions.setdefault(
+            filepath, {'offset': 0, 'inode': None, 'fingerprint': b'', 'pending': []})
+        lines, position['pending'] = position['pending'], []
+        try:
+            info = self.fsspec.info(filepath)
+        except FileNotFoundError:
+            position.update(offset=0, inode=None, fingerprint=b'')
+            return lines
+        inode, size = info.get('ino'), info['size']
+        if size < position['offset'] or (None not in (inode, position['inode']) and inode != position['inode']):
+            logger.info(f'файл {filepath} заменён или усечён, чтение с начала файла')
+            position.update(offset=0, fingerprint=b'')
+        position['inode'] = inode
+        if size == position['offset']:
+            return lines
+        with self.fsspec.open(filepath, 'rb') as f:
+            fingerprint = position['fingerprint']
+            f.seek(position['offset'] - len(fingerprint))
+            if fingerprint and f.read(len(fingerprint)) != fingerprint:
+                logger.info(f'файл {filepath} заменён, чтение с начала файла')
+                position.update(offset=0, fingerprint=b'')
+                f.seek(0)
+            data = f.read(size - position['offset'])
+        # неполная последняя строка будет прочитана при следующем вызове
+        end = data.rfind(b'\n') + 1
+        if end:
+            position['offset'] += end
+            position['fingerprint'] = (position['fingerprint'] + data[:end])[-_LOG_FINGERPRINT_SIZE:]
+            lines.extend(line.decode(encoding, errors='replace') for line in io.BytesIO(data[:end]).readlines())
+        return lines
+
+    @allure.step('Ожидает появления строки {pattern} в файле {filepath} в течение {timeout} сек.')
+    def wait_for_log_line(self, filepath, pattern, timeout: float = 30, poll_interval: float = 0.5) -> str:
+        """
+        Ожидает появления в файле лога строки, соответствующей регулярному выражению. Проверяются только строки,
+        добавленные после follow_log (или предыдущего ожидания), строки после найденной остаются для следующего
+        ожидания.
+        Args:
+            filepath: str путь к файлу лога
+            pattern: str или re.Pattern регулярное выражение
+            timeout: float время ожидания (в секундах)
+            poll_interval: float интервал проверки файла (в секундах)
+        Returns: str найденная строка
+        """
+        regex = re.compile(pattern)
+        deadline = monotonic() + timeout
+        while True:
+            lines = self.read_new_lines(filepath)
+            for i, line in enumerate(lines):
+                if regex.search(line):
+                    self._log_positions[filepath]['pending'] = lines[i + 1:]
+                    return line
+            if monotonic() >= deadline:
+                break
+            sleep(poll_interval)
+        assert False, f'Строка "{regex.pattern}" не появилась в файле "{filepath}" в течение {timeout} сек.'
 
     def directory_content(self, path):
         return [str(f).rsplit('/', 1)[1] for f in self.fsspec.ls(path)]
 
-    def clean_out_directory(self, path, dirs_to_keep=None):
+    def clean_out_directory(self, path, dirs_to_keep=None, use_command: bool = None):
+        """
+        Удаляет файлы каталога и пустые подкаталоги, кроме подкаталогов из dirs_to_keep. Каталог читается одним
+        подробным листингом, файлы удаляются пакетами параллельно.
+        Args:
+            path: путь к каталогу
+            dirs_to_keep: list имён подкаталогов, которые не удаляются
+            use_command: bool удалить одной командой find на удалённом хосте, по умолчанию
+                         settings.remote_bulk_delete
+        """
         dirs_to_keep = [] if not dirs_to_keep else dirs_to_keep
-        for f in self.fsspec.glob(f'{path}/*'):
-            name = f.rsplit("/", 1)[1]
-            if self.fsspec.isfile(f):
-                self.fsspec.rm_file(f)
-            # удаляет не пустой каталог и не в dirs_to_keep списке
-            if self.fsspec.isdir(f) and name not in dirs_to_keep and len(self.fsspec.ls(f)) == 0:
-                self.fsspec.rmdir(f)
+        started = monotonic()
+        if self._use_delete_command(use_command):
+            keep = ''.join(f' ! -name {shlex.quote(glob.escape(d))}' for d in dirs_to_keep)
+            self._run_delete_command(
+                f'find {shlex.quote(str(path))} -mindepth 1 -maxdepth 1 -type f -delete && '
+                f'find {shlex.quote(str(path))} -mindepth 1 -maxdepth 1 -type d -empty{keep} -delete', path, started)
+            return
+        entries = self._entries(path)
+        files = [f for f, is_dir in entries if not is_dir]
+        # непустые каталоги не удаляются: rmdir завершается ошибкой без предварительного листинга каталога
+        dirs = [f for f, is_dir in entries if is_dir and posixpath.basename(f) not in dirs_to_keep]
+        removed_files, removed_dirs = self._remove_paths(files, dirs, ignore_not_empty=True)
+        self._log_removed(path, removed_files, removed_dirs, started)
 
     def copy_file_to_test_project(self, file_path, dir_to_copy_in):
         """
@@ -104,7 +901,8 @@ class FSHandler:
         return local_file_path
 
     @allure.step('Распаковывает архивный файл {src} в папку {dst}')
-    def extract_data_from_compressed_file(self, src: str, dst: str = settings.temp_dir):
+    def extract_data_from_compressed_file(self, src: str, dst: str = settings.temp_dir, stream: bool = False,
+                                          pattern: str = None, max_member_size: int = None):
         """
         Загружает архивный файл в dst каталог и получает его содержимое. Файл может располагаться как на удалённой,
         так и на локальной файловой системе.
@@ -112,18 +910,35 @@ class FSHandler:
             :param src: str полный путь к архивному файлу на локальной или удалённой файловой системе,
             например /tmp/file.tar.gz
             :param dst: str путь к папке для распаковки
+            :param stream: bool читать архив потоком без копирования на локальную файловую систему (dst не
+            используется), см. iter_archive
+            :param pattern: str glob маска имён файлов архива, например '*.json'
+            :param max_member_size: int файлы архива большего размера (в байтах) пропускаются
+        Returns: list строк вида 'файл "имя": содержимое', для бинарных файлов вместо содержимого указывается размер
         """
+        if stream:
+            members = self.iter_archive(src, pattern=pattern, max_member_size=max_member_size)
+            return [_archive_entry(m) for m in members]
         file_name = os.path.basename(src)
         local_path = str(Path(dst, file_name))
         self.fsspec.get(src, local_path)  # копирует с удалённой на локальную файловую систему
-        data_list = []
         with tarfile.open(local_path) as tar:
-            inner_objects = tar.getnames()
-            for obj in inner_objects:
-                obj_data = tar.extractfile(obj)
-                read_data = obj_data.read()
-                data_list.append(f'файл "{obj}": {read_data.decode()}')
-        return data_list
+            return [_archive_entry(m) for m in _archive_members(tar, pattern, max_member_size)]
+
+    def iter_archive(self, src: str, pattern: str = None, max_member_size: int = None, encoding: str = 'utf-8'):
+        """
+        Последовательно читает tar архив (в том числе сжатый gzip, bz2, xz) напрямую из файла на локальной или
+        удалённой файловой системе, без копирования архива и чтения его оглавления. В памяти находится только
+        текущий файл архива.
+        Args:
+            src: str полный путь к архивному файлу
+            pattern: str glob маска имён файлов архива, например 'logs/*.log'
+            max_member_size: int файлы архива большего размера (в байтах) пропускаются без чтения
+            encoding: str кодировка текстовых файлов
+        Returns: генератор dict с ключами name, size, data (str для текстовых файлов, bytes для бинарных)
+        """
+        with self.fsspec.open(src, 'rb') as f, tarfile.open(fileobj=f, mode='r|*') as tar:
+            yield from _archive_members(tar, pattern, max_member_size, encoding)
 
     @allure.step('Копирование файла {local_path} в {remote_path}')
     def put(self, local_path, remote_path):
@@ -136,7 +951,71 @@ class FSHandler:
         self.fsspec.put(str(local_path), str(remote_path))
         logger.info(f'Файл "{local_path}" скопирован в "{remote_path}"')
 
-    def copy_local_dir_to_remote(self, local_path, remote_path):
+    def _copy_tree(self, src_root, dst_root, upload: bool, max_workers: int = None, skip_existing: str = 'mtime'):
+        """
+        Копирует дерево каталогов: оба дерева обходятся один раз, недостающие каталоги создаются по уровням
+        вложенности, файлы передаются параллельно по нескольким SFTP каналам. Время изменения файлов сохраняется,
+        что позволяет пропускать неизменённые файлы при повторном копировании.
+        """
+        assert skip_existing in (None, 'mtime', 'hash'), 'Допустимые значения skip_existing: None, mtime, hash'
+        started = monotonic()
+        src_root, dst_root = str(src_root).rstrip('/') or '/', str(dst_root).rstrip('/') or '/'
+        if upload:
+            src_dirs, src_files = _local_tree(src_root)
+            self.fsspec.makedirs(dst_root, exist_ok=True)
+            dst_dirs, dst_files = _fs_tree(self.fsspec, dst_root)
+        else:
+            src_dirs, src_files = _fs_tree(self.fsspec, src_root)
+            os.makedirs(dst_root, exist_ok=True)
+            dst_dirs, dst_files = _local_tree(dst_root)
+
+        candidates = [f for f, (size, mtime) in src_files.items() if skip_existing and f in dst_files
+                      and dst_files[f][0] == size and (skip_existing == 'hash' or int(dst_files[f][1]) == int(mtime))]
+        if skip_existing == 'hash' and candidates:
+            remote_hashes = _fs_hashes(self.fsspec, dst_root if upload else src_root)
+            candidates = [f for f in candidates if
+                          remote_hashes.get(f) == _local_hash(os.path.join(src_root if upload else dst_root, f))]
+        skipped = set(candidates)
+        files = [f for f in src_files if f not in skipped]
+        new_dirs = sorted(set(src_dirs) - set(dst_dirs), key=lambda d: d.count('/'))
+
+        def make_dir(relative):
+            with self.fsspec.transfer_channel() as channel:
+                channel.mkdir(posixpath.join(dst_root, relative))
+
+        def copy(relative):
+            src, dst = posixpath.join(src_root, relative), posixpath.join(dst_root, relative)
+            mtime = src_files[relative][1]
+            with self.fsspec.transfer_channel() as channel:
+                if upload:
+                    channel.put(src, dst)
+                    channel.utime(dst, (mtime, mtime))
+                else:
+                    channel.get(src, dst)
+            if not upload:
+                os.utime(dst, (mtime, mtime))
+
+        with ThreadPoolExecutor(max_workers=max_workers if max_workers else settings.transfer_workers) as executor:
+            if upload:
+                # каталоги одного уровня создаются параллельно после создания родительских
+                for depth in sorted({d.count('/') for d in new_dirs}):
+                    list(executor.map(make_dir, [d for d in new_dirs if d.count('/') == depth]))
+            else:
+                for d in new_dirs:
+                    os.makedirs(os.path.join(dst_root, d), exist_ok=True)
+            list(executor.map(copy, files))
+
+        duration = monotonic() - started
+        size = sum(src_files[f][0] for f in files)
+        stats = {'files': len(files), 'skipped': len(skipped), 'dirs': len(new_dirs), 'bytes': size,
+                 'duration': duration, 'throughput': size / duration / 1024 / 1024 if duration > 0 else 0}
+        logger.info(f'Каталог {src_root} скопирован в {dst_root}: файлов {stats["files"]}, пропущено '
+                    f'неизменённых {stats["skipped"]}, создано каталогов {stats["dirs"]}, {size} байт за '
+                    f'{duration:.3f} сек. ({stats["throughput"]:.2f} МБ/сек.)')
+        return stats
+
+    def copy_local_dir_to_remote(self, local_path, remote_path, max_workers: int = None,
+                                 skip_existing: str = 'mtime') -> dict:
         """
         Копирование каталога с локальной файловой системы на удалённую (в зависимости от конфигурации и на локальную).
         Если в файле конфигурации [fs] host указан локальный адрес и port 22, то копирование происходит в пределах
@@ -145,20 +1024,16 @@ class FSHandler:
         Args:
             local_path: str путь к локальному каталогу
             remote_path: str путь к удалённому каталогу
+            max_workers: int количество файлов, передаваемых одновременно, по умолчанию settings.transfer_workers
+            skip_existing: str не копировать файлы, совпадающие по размеру и времени изменения (mtime) или по
+                           размеру и sha256 (hash), None - копировать все файлы
+        Returns: dict статистика копирования: files, skipped, dirs, bytes, duration (сек.), throughput (МБ/сек.)
         """
-        self.fsspec.makedirs(remote_path, exist_ok=True)
-        for item in os.listdir(local_path):
-            local_item = os.path.join(local_path, item)
-            remote_item = os.path.join(remote_path, item)
-            if os.path.isfile(local_item):
-                self.fsspec.put(local_item, remote_item)
-                logger.info(f'-- {remote_item} скопирован')
-            else:
-                self.fsspec.mkdirs(remote_item, exist_ok=True)
-                logger.info(f'++ {remote_item} каталог создан')
-                self.copy_local_dir_to_remote(local_item, remote_item)
+        return self._copy_tree(local_path, remote_path, upload=True, max_workers=max_workers,
+                               skip_existing=skip_existing)
 
-    def copy_remote_dir_to_local(self, remote_path, local_path):
+    def copy_remote_dir_to_local(self, remote_path, local_path, max_workers: int = None,
+                                 skip_existing: str = 'mtime') -> dict:
         """
         Копирование каталога с удалённой системы на локальную.
         Если в файле конфигурации [fs] host указан локальный адрес и port 22, то копирование происходит в пределах
@@ -167,47 +1042,122 @@ class FSHandler:
         Args:
             remote_path: str путь к удалённому каталогу
             local_path: str путь к локальному каталогу
+            max_workers: int количество файлов, передаваемых одновременно, по умолчанию settings.transfer_workers
+            skip_existing: str не копировать файлы, совпадающие по размеру и времени изменения (mtime) или по
+                           размеру и sha256 (hash), None - копировать все файлы
+        Returns: dict статистика копирования: files, skipped, dirs, bytes, duration (сек.), throughput (МБ/сек.)
         """
-        os.makedirs(local_path, exist_ok=True)
-        for item in self.fsspec.glob('{}/*'.format(remote_path)):
-            item_name = os.path.basename(item)
-            local_item = os.path.join(local_path, item_name)
-            if self.fsspec.isfile(item):
-                self.fsspec.get_file(item, os.path.join(local_path, item_name))
-                logger.info(f'-- {local_item} скопирован')
-            else:
-                Path(local_item).mkdir(parents=True, exist_ok=True)
-                logger.info(f'++ {local_item} каталог создан')
-                self.copy_remote_dir_to_local(item, local_item)
+        return self._copy_tree(remote_path, local_path, upload=False, max_workers=max_workers,
+                               skip_existing=skip_existing)
+
+    def _entries(self, path) -> list:
+        """
+        Подробный листинг каталога одним запросом
+        Returns: list кортежей (полный путь, является ли каталогом), символические ссылки не считаются каталогами
+        """
+        if isinstance(self.fsspec, LocalFileSystem):
+            with os.scandir(path) as entries:
+                return [(posixpath.join(str(path), e.name), e.is_dir(follow_symlinks=False)) for e in entries]
+        with self.fsspec.transfer_channel() as channel:
+            return [(posixpath.join(str(path), a.filename), stat.S_ISDIR(a.st_mode))
+                    for a in channel.listdir_attr(str(path))]
+
+    def _remove_paths(self, files: list, dirs: list = (), ignore_not_empty: bool = False):
+        """
+        Удаляет файлы пакетами по settings.delete_batch_size параллельно в нескольких SFTP каналах, затем каталоги
+        (сначала вложенные)
+        Args:
+            ignore_not_empty: bool пропускать непустые каталоги
+        Returns: tuple (количество удалённых файлов, количество удалённых каталогов)
+        """
+        def remove_batch(batch):
+            with self.fsspec.transfer_channel() as channel:
+                for f in batch:
+                    channel.remove(f)
+            return len(batch)
+
+        def remove_dirs(batch):
+            removed = 0
+            with self.fsspec.transfer_channel() as channel:
+                for d in batch:
+                    try:
+                        channel.rmdir(d)
+                        removed += 1
+                    except OSError as e:
+                        if not ignore_not_empty or not _is_not_empty_error(channel, d, e):
+                            raise
+            return removed
+
+        size = settings.delete_batch_size
+        with ThreadPoolExecutor(max_workers=settings.transfer_workers) as executor:
+            removed_files = sum(executor.map(remove_batch, [files[i:i + size] for i in range(0, len(files), size)]))
+            removed_dirs = 0
+            for depth in sorted({d.count('/') for d in dirs}, reverse=True):
+                level = [d for d in dirs if d.count('/') == depth]
+                removed_dirs += sum(executor.map(remove_dirs, [level[i:i + size] for i in range(0, len(level), size)]))
+        return removed_files, removed_dirs
+
+    def _use_delete_command(self, use_command: bool = None) -> bool:
+        use_command = settings.remote_bulk_delete if use_command is None else use_command
+        return use_command and not isinstance(self.fsspec, LocalFileSystem)
+
+    def _run_delete_command(self, command, path, started):
+        result = self.fsspec.execute(command)
+        if not result.ok:
+            raise OSError(f'Ошибка удаления в каталоге {path}: {result.stderr}')
+        logger.info(f'каталог {path} очищен командой "{command}" за {monotonic() - started:.3f} сек.')
+
+    @staticmethod
+    def _log_removed(path, files, dirs, started):
+        logger.info(f'из каталога {path} удалено файлов: {files}, каталогов: {dirs} '
+                    f'за {monotonic() - started:.3f} сек.')
 
-    def remove_dir(self, dirpath):
+    def remove_dir(self, dirpath, use_command: bool = None):
+        """
+        Удаляет каталог со всем содержимым. Дерево каталога читается один раз, файлы удаляются пакетами параллельно.
+        Args:
+            dirpath: путь к каталогу
+            use_command: bool удалить одной командой rm -rf на удалённом хосте, по умолчанию
+                         settings.remote_bulk_delete
+        """
         logger.info(f'удаляется каталог {dirpath} ...')
-        if self.fsspec.isdir(dirpath):
-            files = self.fsspec.listdir(path=dirpath, detail=False)
-            for f in files:
-                filepath = os.path.join(dirpath, f)
-                if not self.fsspec.isdir(filepath):
-                    self.fsspec.rm_file(filepath)
-                    logger.info(f'\t-- файл {filepath} удалён')
-                else:
-                    self.remove_dir(filepath)
-            self.fsspec.rmdir(dirpath)
-            logger.info(f'каталог {dirpath} удалён')
+        if not self.fsspec.isdir(dirpath):
+            return
+        started = monotonic()
+        if self._use_delete_command(use_command):
+            self._run_delete_command(f'rm -rf -- {shlex.quote(str(dirpath))}', dirpath, started)
+            return
+        dirpath = str(dirpath).rstrip('/')
+        if isinstance(self.fsspec, LocalFileSystem):
+            dirs, files = _local_tree(dirpath)
+            shutil.rmtree(dirpath)
+            self._log_removed(dirpath, len(files), len(dirs) + 1, started)
+            return
+        dirs, files = _fs_tree(self.fsspec, dirpath)
+        removed_files, removed_dirs = self._remove_paths([posixpath.join(dirpath, f) for f in files],
+                                                         [posixpath.join(dirpath, d) for d in dirs] + [dirpath])
+        self._log_removed(dirpath, removed_files, removed_dirs, started)
 
-    def remove_files(self, path, exclusion_mask=None):
+    def remove_files(self, path, exclusion_mask=None, use_command: bool = None):
         """
         Удаляет все файлы в каталоге (кроме подкаталогов), если не задано исключение по маске.
         Args:
             path: путь к каталогу
             exclusion_mask: маска, например 'json'
+            use_command: bool удалить одной командой find на удалённом хосте, по умолчанию
+                         settings.remote_bulk_delete
         """
         logger.info(f'удаляются файлы из каталога {path}')
-        files = (f for f in self.fsspec.glob(f'{path}/*') if self.fsspec.isfile(f))
-        for f in files:
-            if exclusion_mask and f.endswith(exclusion_mask):
-                continue
-            self.fsspec.rm_file(f)
-            logger.info(f'\t-- {f} удалён')
+        started = monotonic()
+        if self._use_delete_command(use_command):
+            exclude = f' ! -name {shlex.quote("*" + glob.escape(exclusion_mask))}' if exclusion_mask else ''
+            self._run_delete_command(
+                f'find {shlex.quote(str(path))} -mindepth 1 -maxdepth 1 -type f{exclude} -delete', path, started)
+            return
+        files = [f for f, is_dir in self._entries(path)
+                 if not is_dir and not (exclusion_mask and f.endswith(exclusion_mask))]
+        removed_files, _ = self._remove_paths(files)
+        self._log_removed(path, removed_files, 0, started)
 
     def remove_file(self, path_to_file):
         """
@@ -216,9 +1166,17 @@ class FSHandler:
             path_to_file: полный путь к файлу
         """
         logger.info(f'удаляется файл {path_to_file}')
-        if self.fsspec.isfile(path_to_file):
-            self.fsspec.rm_file(path_to_file)
-            logger.info(f'\t-- {path_to_file} удалён')
+        with self.fsspec.transfer_channel() as channel:
+            try:
+                channel.remove(str(path_to_file))
+            except FileNotFoundError:
+                return
+            except OSError:
+                # каталог не удаляется (IsADirectoryError локально, общая ошибка SFTP), как и прежде без ошибки
+                if stat.S_ISDIR(channel.stat(str(path_to_file)).st_mode):
+                    return
+                raise
+        logger.info(f'\t-- {path_to_file} удалён')
 
     @allure.step('Проверяет наличие файла {path_to_file} на файловой системе')
     def should_file_exist(self, path_to_file):
@@ -230,29 +1188,113 @@ class FSHandler:
         assert self.fsspec.isfile(path_to_file), f'Файл {path_to_file} не существует'
 
     @allure.step('Выполняется команда {command}')
-    def run(self, command, status=True, background=False, output=False):
+    def run(self, command, status=True, background=False, output=False, timeout=None):
         settings.logger.info(f'\tвыполняется команда: "{command}, с параметрами:'
                              f' status={status}, background={background}, output={output}"')
-        return self.fsspec.run(command, status=status, background=background, output=output)
+        return self.fsspec.run(command, status=status, background=background, output=output, timeout=timeout)
+
+    @allure.step('Выполняется команда {command}')
+    def execute(self, command, timeout=None, output_limit=None) -> CommandResult:
+        """
+        Выполняет команду и возвращает код завершения, полный вывод stdout и stderr и время выполнения
+        Args:
+            command: str команда
+            timeout: float время ожидания завершения (в секундах), None - без ограничения
+            output_limit: int размер сохраняемого вывода (в байтах), по умолчанию settings.command_output_limit
+        Returns: CommandResult
+        """
+        settings.logger.info(f'\tвыполняется команда: "{command}"')
+        result = self.fsspec.execute(command, timeout=timeout, output_limit=output_limit)
+        if result.timed_out:
+            settings.logger.warning(f'\tкоманда "{command}" не завершилась за {timeout} сек.')
+        else:
+            settings.logger.info(f'\tкоманда "{command}" завершена с кодом {result.exit_code} '
+                                 f'за {result.duration:.3f} сек.')
+        return result
+
+    @allure.step('Выполняются команды {commands}')
+    def execute_many(self, commands: list, max_workers: int = None, timeout: float = None) -> list:
+        """
+        Параллельно выполняет команды в отдельных каналах одного соединения, см. execute_batch
+        Returns: список CommandResult в порядке commands
+        """
+        calls = [(self.fsspec, c) for c in commands]
+        return [result for _, result in _execute_calls(calls, max_workers=max_workers, timeout=timeout)]
 
+    @staticmethod
+    @allure.step('Выполняется команда {command} на хостах')
+    def execute_on_hosts(targets: list, command: str, max_workers: int = None, timeout: float = None) -> list:
+        """
+        Параллельно выполняет команду на нескольких хостах, время выполнения определяется самым медленным хостом
+        Args:
+            targets: list файловых систем get_fsspec или FSHandler
+            command: str команда
+            max_workers: int количество хостов, на которых команда выполняется одновременно
+            timeout: float время ожидания завершения команды (в секундах)
+        Returns: список CommandResult в порядке targets
+        """
+        calls = [(t, command) for t in targets]
+        return [result for _, result in _execute_calls(calls, max_workers=max_workers, timeout=timeout)]
+
+    def _entries_count(self, dirs) -> dict:
+        """
+        Количество элементов в каталогах за один проход (одним SFTP каналом для удалённой файловой системы)
+        Returns: dict {каталог: количество элементов или None, если каталога нет}
+        """
+        counts = {}
+        with self.fsspec.transfer_channel() as channel:
+            for d in dirs:
+                try:
+                    counts[d] = len(channel.listdir(d))
+                except (FileNotFoundError, NotADirectoryError):
+                    counts[d] = None
+        return counts
 
     @allure.step('Ожидает появления файлов в каталогах {dirs} в течение {timeout} сек.')
-    def waiting_for_directories_to_fill(self, dirs: list, files_amount=None, timeout=30):
-        _timeout = timeout
-        for d in dirs:
-            is_filled = False
-            while not is_filled and timeout > 0:
-                if not self.fsspec.isdir(d):  # если каталога нет
-                    timeout -= 1
-                    sleep(1)
-                    continue
-                if not files_amount and self.fsspec.listdir(d, detail=False):
-                    # если не задано количество файлов и не пустой каталог
-                    is_filled = True
-                elif files_amount and len(self.fsspec.listdir(d, detail=False)) >= files_amount:
-                    # если файлов в каталоге больше или равно заданному количеству файлов
-                    is_filled = True
+    def waiting_for_directories_to_fill(self, dirs: list, files_amount=None, timeout=30) -> dict:
+        """
+        Ожидает появления файлов во всех каталогах одновременно: все каталоги проверяются за один проход. На
+        локальной файловой системе проверка выполняется по событиям inotify, на удалённой - с увеличивающимся
+        интервалом (от 0.1 до 2 сек.), который сбрасывается при изменении количества файлов.
+        Args:
+            dirs: list каталогов
+            files_amount: int минимальное количество файлов в каждом каталоге или dict {каталог: количество},
+                          None - каталог не пустой
+            timeout: float общее время ожидания (в секундах)
+        Returns: dict {каталог: время (в секундах) от начала ожидания до появления файлов}
+        """
+        pending = {d: (files_amount.get(d) if isinstance(files_amount, dict) else files_amount) or 1 for d in dirs}
+        started = monotonic()
+        deadline = started + timeout
+        timings = {}
+        watcher = _Inotify.create() if isinstance(self.fsspec, LocalFileSystem) else None
+        interval, previous = _POLL_MIN, None
+        try:
+            while True:
+                if watcher:
+                    # подписка до подсчёта, чтобы не пропустить файлы, созданные между подсчётом и ожиданием
+                    for d in pending:
+                        if os.path.isdir(d):
+                            watcher.watch(d)
+                        elif os.path.isdir(os.path.dirname(d)):
+                            watcher.watch(os.path.dirname(d))  # создание самого каталога
+                counts = self._entries_count(pending)
+                for d, count in counts.items():
+                    if count is not None and count >= pending[d]:
+                        timings[d] = monotonic() - started
+                        del pending[d]
+                remaining = deadline - monotonic()
+                if not pending or remaining <= 0:
+                    break
+                interval = _POLL_MIN if counts != previous else min(interval * _POLL_BACKOFF, _POLL_MAX)
+                previous = counts
+                if watcher:
+                    watcher.wait(min(remaining, 1))
                 else:
-                    timeout -= 1
-                    sleep(1)
-            assert is_filled, f'Файлы не появились в каталоге "{d}" в течение "{_timeout}" сек.'
+                    sleep(min(interval, remaining))
+        finally:
+            if watcher:
+                watcher.close()
+        assert not pending, f'Файлы не появились в каталогах {list(pending)} в течение "{timeout}" сек.'
+        logger.info('Файлы появились в каталогах:\n' + '\n'.join(f'- {d}: {t:.3f} сек.' for d, t in timings.items()))
+        return timings
@@ -1,18 +1,299 @@
+import asyncio
+import base64
+import hashlib
 import http.cookies
+import json
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from random import random
+from time import perf_counter, time
 from urllib.parse import urlunparse, urlsplit
 
+import httpx
 import requests
 from requests import Response
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
 
+from qa_testlab import settings
 from qa_testlab.settings import logger
 
 
+# типы содержимого, тело которых логируется как текст
+_TEXT_CONTENT_TYPES = ('text/', 'json', 'xml', 'javascript', 'x-www-form-urlencoded')
+
+
+def _truncate(text: str, limit: int) -> str:
+    if limit and len(text) > limit:
+        return f'{text[:limit]}... (обрезано, всего {len(text)} символов)'
+    return text
+
+
+def _response_body(response, limit: int) -> str:
+    """
+    Текст ответа для лога: тело не читается для потоковых ответов, не декодируется для бинарных и декодируется
+    только в пределах limit байт
+    """
+    # requests: _content = False до чтения тела, httpx: атрибута _content нет до чтения тела
+    if getattr(response, '_content', False) is False:
+        return '<потоковый ответ, тело не прочитано>'
+    content = response.content or b''
+    content_type = response.headers.get('content-type', '')
+    if content and content_type and not any(t in content_type.lower() for t in _TEXT_CONTENT_TYPES):
+        return f'<бинарные данные {content_type}, {len(content)} байт>'
+    text = content[:limit].decode(response.encoding or 'utf-8', errors='replace') if limit else response.text
+    if limit and len(content) > limit:
+        return f'{text}... (обрезано, всего {len(content)} байт)'
+    return text
+
+
+def _log_api_call(method, url, data, response, details=None):
+    """
+    Логирует запрос и ответ API в едином для синхронного и асинхронного клиентов формате. Сообщение формируется только
+    если уровень логирования включён, тело ответа и данные запроса обрезаются до settings.rest_log_body_limit,
+    успешные запросы логируются с вероятностью settings.rest_log_success_sample_rate
+    Args:
+        details: callable, возвращающий tuple (headers сессии, cookies сессии, cookies ответа), если нужно логировать
+                 header и cookies
+    """
+    if response.status_code == 500:
+        level = logging.CRITICAL
+    elif not 200 <= response.status_code <= 299:
+        level = logging.ERROR
+    else:
+        level = logging.INFO
+        if settings.rest_log_success_sample_rate < 1 and random() >= settings.rest_log_success_sample_rate:
+            return
+    if not logger.isEnabledFor(level):
+        return
+
+    limit = settings.rest_log_body_limit
+    request_log = f'Request params:\n' \
+                  f'- method: {method}\n- url: {url}\n- data: {_truncate(str(data), limit)}'
+
+    response_log = f'Response params:\n' \
+                   f'- status code: {response.status_code}\n- response text: {_response_body(response, limit)}' \
+
+    if details:
+        session_headers, session_cookies, response_cookies = details()
+        request_log = f'{request_log}\n' \
+                      f'- headers: {session_headers}\n' \
+                      f'- cookies: {session_cookies}'
+        response_log = f'{response_log}\n' \
+                       f'- headers: {response.headers}\n' \
+                       f'- cookies: {response_cookies}'
+
+    log_entry = f'{request_log}\n{response_log}'
+
+    if level != logging.INFO:
+        logger.log(level, f'Status code {response.status_code} received.\n{log_entry}')
+    else:
+        logger.info(log_entry)
+
+
+class _StreamingBody(object):
+    """
+    Тело запроса, читаемое из файла частями. Размер известен заранее (Content-Length), контрольная сумма
+    вычисляется по мере отправки.
+    """
+    def __init__(self, file_path, chunk_size: int, checksum: str = None, field: str = None, fields: dict = None):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self.hash = hashlib.new(checksum) if checksum else None
+        self.sent = 0
+        self.preamble, self.epilogue = b'', b''
+        self.content_type = 'application/octet-stream'
+        if field:  # multipart/form-data: поля формы и заголовок файла до содержимого, завершающая граница после
+            boundary = uuid.uuid4().hex
+            parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                     for name, value in (fields or {}).items()]
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; '
+                         f'filename="{Path(file_path).name}"\r\nContent-Type: application/octet-stream\r\n\r\n')
+            self.preamble = ''.join(parts).encode()
+            self.epilogue = f'\r\n--{boundary}--\r\n'.encode()
+            self.content_type = f'multipart/form-data; boundary={boundary}'
+        self.file_size = os.path.getsize(file_path)
+
+    def __len__(self):
+        return len(self.preamble) + self.file_size + len(self.epilogue)
+
+    def __iter__(self):
+        if self.preamble:
+            yield self.preamble
+        with open(self.file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                if self.hash:
+                    self.hash.update(chunk)
+                self.sent += len(chunk)
+                yield chunk
+        if self.epilogue:
+            yield self.epilogue
+
+
+def _transfer_log(direction, method, url, response, size, duration, checksum=None):
+    throughput = size / duration / 1024 / 1024 if duration > 0 else 0
+    message = f'{direction}:\n- method: {method}\n- url: {url}\n- status code: {response.status_code}\n' \
+              f'- content type: {response.headers.get("content-type")}\n- size: {size} байт\n' \
+              f'- duration: {duration:.3f} сек.\n- throughput: {throughput:.2f} МБ/сек.'
+    if checksum:
+        message = f'{message}\n- checksum: {checksum}'
+    if 200 <= response.status_code <= 299:
+        logger.info(message)
+    else:
+        logger.error(f'Status code {response.status_code} received.\n{message}')
+    return throughput
+
+
+class ApiCassette(object):
+    """
+    Запись ответов API в файл и их воспроизведение без обращения к API. Запись определяется методом, URL запроса
+    (схема, хост, порт и путь) и нормализованными данными запроса (params, json, data), заголовки и cookies в ключ не
+    входят.
+    Режимы:
+        off - запись и воспроизведение выключены
+        record - все запросы выполняются, успешные ответы записываются
+        replay - ответ берётся из записи, при отсутствии или устаревании записи запрос выполняется и записывается
+        replay_only - ответ берётся только из записи, при отсутствии записи вызывается исключение
+    """
+    MODES = ('off', 'record', 'replay', 'replay_only')
+
+    def __init__(self, path, mode: str = 'replay', ttl: float = 0, methods: tuple = ('GET',)):
+        """
+        Args:
+            path: путь к файлу записей
+            mode (str): режим работы, см. MODES
+            ttl (float): время жизни записи (в секундах), 0 - без ограничения
+            methods (tuple): методы, ответы которых записываются и воспроизводятся
+        """
+        assert mode in self.MODES, f'Допустимые значения mode: {self.MODES}'
+        self.path = Path(path)
+        self.mode = mode
+        self.ttl = ttl
+        self.methods = tuple(m.upper() for m in methods)
+        self._records = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(method: str, url: str, data: dict) -> str:
+        def normalize(value):
+            if isinstance(value, (list, tuple)) and all(isinstance(v, (list, tuple)) for v in value):
+                return sorted([list(v) for v in value], key=str)  # params/data в виде списка пар
+            return value
+        u = urlsplit(url)
+        request = {'method': method.upper(), 'url': urlunparse((u.scheme, u.netloc, u.path, '', '', '')),
+                   **{name: normalize(data.get(name)) for name in ('params', 'json', 'data')}}
+        return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+    def handles(self, method: str, data: dict) -> bool:
+        return self.mode != 'off' and method.upper() in self.methods and not data.get('stream') \
+            and not data.get('files')
+
+    def _load(self):
+        if self._records is None:
+            try:
+                with open(self.path) as f:
+                    self._records = json.load(f)
+            except (OSError, ValueError):
+                self._records = {}
+        return self._records
+
+    def _save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+            with open(temp_path, 'w') as f:
+                json.dump(self._records, f, indent=2, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logger.warning(f'Не удалось сохранить записи ответов API: {e}')
+
+    def replay(self, method: str, url: str, data: dict):
+        """
+        Returns: Response из записи или None, если запись отсутствует, устарела или режим не предполагает
+                 воспроизведение
+        """
+        if self.mode not in ('replay', 'replay_only'):
+            return None
+        key = self.key(method, url, data)
+        with self._lock:
+            record = self._load().get(key)
+        if record and self.ttl and time() - record['recorded'] > self.ttl:
+            record = None
+        if record is None:
+            if self.mode == 'replay_only':
+                raise LookupError(f'Нет записи ответа для запроса {method.upper()} {url} в {self.path}')
+            return None
+        response = Response()
+        response.status_code = record['status_code']
+        response.reason = record['reason']
+        response.headers = CaseInsensitiveDict(record['headers'])
+        response.encoding = record['encoding']
+        response.url = record['url']
+        response._content = base64.b64decode(record['content'])
+        response.elapsed = timedelta(0)
+        return response
+
+    def record(self, method: str, url: str, data: dict, response: Response):
+        """
+        Записывает успешный ответ (статус 2xx) и сохраняет файл записей
+        """
+        if self.mode not in ('record', 'replay') or not 200 <= response.status_code <= 299:
+            return
+        record = {'method': method.upper(), 'path': urlsplit(url).path, 'url': response.url,
+                  'status_code': response.status_code, 'reason': response.reason, 'headers': dict(response.headers),
+                  'encoding': response.encoding, 'content': base64.b64encode(response.content).decode(),
+                  'recorded': time()}
+        with self._lock:
+            self._load()[self.key(method, url, data)] = record
+            self._save()
+
+
 class RestfullApiClient(object):
-    def __init__(self, url, username=None, password=None):
+    def __init__(self, url, username=None, password=None,
+                 pool_connections: int = 10,
+                 pool_maxsize: int = 10,
+                 max_retries: int = 0,
+                 backoff_factor: float = 0,
+                 retry_statuses: tuple = (502, 503, 504),
+                 keep_alive: bool = True,
+                 cassette: ApiCassette = None):
+        """
+        Args:
+            url (str): базовый адрес API
+            username (str): имя пользователя
+            password (str): пароль
+            pool_connections (int): количество пулов соединений (по одному на хост)
+            pool_maxsize (int): максимальное количество соединений в пуле, должно быть не меньше количества
+                                параллельных запросов call_many
+            max_retries (int): количество повторов идемпотентных запросов при ошибках соединения и статусах
+                               retry_statuses (таймауты чтения не повторяются)
+            backoff_factor (float): множитель экспоненциальной задержки между повторами (в секундах)
+            retry_statuses (tuple): статусы ответа, при которых запрос повторяется
+            keep_alive (bool): переиспользовать соединения между запросами
+            cassette (ApiCassette): запись и воспроизведение ответов, по умолчанию создаётся по настройкам
+                                    settings.rest_cassette, rest_cassette_mode и rest_cassette_ttl
+        """
         self.url = url
+        self.cassette = cassette if cassette else ApiCassette(settings.rest_cassette, settings.rest_cassette_mode,
+                                                              settings.rest_cassette_ttl)
         self.session = requests.Session()
         self.username = username if username else 'admin'
         self.password = password if password else 'admin'
+        self.pool_maxsize = pool_maxsize
+        # read=False: таймаут чтения не повторяется и вызывает requests.ReadTimeout, как без повторов
+        retries = Retry(total=max_retries, read=False, backoff_factor=backoff_factor, status_forcelist=retry_statuses,
+                        raise_on_status=False) if max_retries else 0
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if not keep_alive:
+            self.session.headers.update({'Connection': 'close'})
 
     def call_api(self, method: str, path: str, request_data: dict = None, log_details: bool = False) -> Response:
         """Вызов API запроса
@@ -34,32 +315,117 @@ class RestfullApiClient(object):
         Returns: экземпляр класса Response
         """
         u = urlsplit(self.url)
+        url = urlunparse((u.scheme, u.netloc, path, '', '', ''))
         data = request_data if request_data else {}
-        response = self.session.request(method, urlunparse((u.scheme, u.netloc, path, '', '', '')), **data)
-        request_log = f'Request params:\n' \
-                      f'- method: {method}\n- url: {self.url}{path}\n- data: {data}'
-
-        response_log = f'Response params:\n' \
-                       f'- status code: {response.status_code}\n- response text: {response.text}' \
-
-        if log_details:
-            request_log = f'{request_log}\n' \
-                          f'- headers: {self.session.headers}\n' \
-                          f'- cookies: {self.session.cookies.get_dict()}'
-            response_log = f'{response_log}\n' \
-                           f'- headers: {response.headers}\n' \
-                           f'- cookies: {response.cookies.get_dict()}'
-
-        log_entry = f'{request_log}\n{response_log}'
-
-        if response.status_code == 500:
-            logger.fatal(f'Status code {response.status_code} received.\n{log_entry}')
-        elif not 200 <= response.status_code <= 299:
-            logger.error(f'Status code {response.status_code} received.\n{log_entry}')
-        else:
-            logger.info(log_entry)
+        use_cassette = self.cassette.handles(method, data)
+        response = self.cassette.replay(method, url, data) if use_cassette else None
+        if response is not None:
+            logger.info(f'Response replayed from {self.cassette.path}: {method.upper()} {self.url}{path}, '
+                        f'status code {response.status_code}')
+            return response
+        response = self.session.request(method, url, **data)
+        if use_cassette:
+            self.cassette.record(method, url, data, response)
+        details = (lambda: (self.session.headers, self.session.cookies.get_dict(), response.cookies.get_dict())) \
+            if log_details else None
+        _log_api_call(method, f'{self.url}{path}', data, response, details)
         return response
 
+    def download_to(self, file_path, path: str, method: str = 'get', request_data: dict = None,
+                    chunk_size: int = 1024 * 1024, checksum: str = None) -> dict:
+        """Потоковое скачивание ответа API в файл частями, без загрузки тела ответа в память. Логируются только
+        метаданные запроса. Файл создаётся только при успешном статусе ответа.
+        Args:
+            file_path: путь к локальному файлу
+            path (str): путь к ресурсу, например /export/123
+            method (str): http метод
+            request_data (dict): параметры запроса, аналогично call_api
+            chunk_size (int): размер части (в байтах)
+            checksum (str): алгоритм контрольной суммы hashlib, например sha256 или md5
+
+        Returns: dict с ключами response (Response с непрочитанным телом), path, size (в байтах), checksum,
+                 duration (в секундах), throughput (МБ/сек.)
+        """
+        u = urlsplit(self.url)
+        data = dict(request_data) if request_data else {}
+        data['stream'] = True
+        file_hash = hashlib.new(checksum) if checksum else None
+        size = 0
+        started = perf_counter()
+        with self.session.request(method, urlunparse((u.scheme, u.netloc, path, '', '', '')), **data) as response:
+            if 200 <= response.status_code <= 299:
+                Path(file_path).parent.mkdir(parents=True, exist_ok=True)
+                with open(file_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        size += len(chunk)
+                        if file_hash:
+                            file_hash.update(chunk)
+        duration = perf_counter() - started
+        digest = file_hash.hexdigest() if file_hash and size else None
+        throughput = _transfer_log('Download', method, f'{self.url}{path}', response, size, duration, digest)
+        return {'response': response, 'path': str(file_path), 'size': size, 'checksum': digest,
+                'duration': duration, 'throughput': throughput}
+
+    def upload_from(self, file_path, path: str, method: str = 'post', field: str = 'file', request_data: dict = None,
+                    chunk_size: int = 1024 * 1024, checksum: str = None) -> dict:
+        """Потоковая загрузка файла частями, без чтения файла в память. Логируются только метаданные запроса.
+        Args:
+            file_path: путь к локальному файлу
+            path (str): путь к ресурсу, например /import
+            method (str): http метод
+            field (str): название поля формы multipart/form-data, None - содержимое файла передаётся телом запроса
+                (Content-Type application/octet-stream, если не указан в headers)
+            request_data (dict): параметры запроса, аналогично call_api. Значения data передаются полями формы,
+                при field=None data и json не поддерживаются (тело запроса - содержимое файла)
+            chunk_size (int): размер части (в байтах)
+            checksum (str): алгоритм контрольной суммы hashlib, например sha256 или md5
+
+        Returns: dict с ключами response, size (в байтах), checksum, duration (в секундах), throughput (МБ/сек.)
+        """
+        u = urlsplit(self.url)
+        data = dict(request_data) if request_data else {}
+        assert 'json' not in data, 'Параметр json не поддерживается при потоковой загрузке файла'
+        assert field or 'data' not in data, 'Параметр data не поддерживается при field=None: телом запроса ' \
+                                            'передаётся содержимое файла'
+        fields = data.pop('data', None)
+        body = _StreamingBody(file_path, chunk_size, checksum, field, fields)
+        headers = dict(data.get('headers') or {})
+        # multipart/form-data задаётся всегда (граница формируется в теле), тип содержимого файла - если не указан
+        if field or not any(k.lower() == 'content-type' for k in headers):
+            headers = {k: v for k, v in headers.items() if k.lower() != 'content-type'}
+            headers['Content-Type'] = body.content_type
+        data['headers'] = headers
+        started = perf_counter()
+        response = self.session.request(method, urlunparse((u.scheme, u.netloc, path, '', '', '')), data=body, **data)
+        duration = perf_counter() - started
+        digest = body.hash.hexdigest() if body.hash else None
+        throughput = _transfer_log('Upload', method, f'{self.url}{path}', response, body.sent, duration, digest)
+        return {'response': response, 'size': body.sent, 'checksum': digest, 'duration': duration,
+                'throughput': throughput}
+
+    def call_many(self, calls: list, max_workers: int = None, log_details: bool = False) -> list:
+        """Параллельное выполнение API запросов в одной сессии (общие cookies и headers)
+        Args:
+            calls (list): список словарей с параметрами call_api, например
+                [
+                    {'method': 'post', 'path': '/user', 'request_data': {'json': {'name': 'user_1'}}},
+                    {'method': 'get', 'path': '/user/1'}
+                ]
+            max_workers (int): количество параллельных запросов, по умолчанию pool_maxsize
+            log_details (bool): логировать header и cookies
+
+        Returns: список экземпляров класса Response в порядке calls, время выполнения запроса в Response.elapsed
+        """
+        max_workers = max_workers if max_workers else self.pool_maxsize
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            responses = list(executor.map(
+                lambda c: self.call_api(c['method'], c['path'], c.get('request_data'), log_details), calls))
+        timings = '\n'.join(f'- {c["method"].upper()} {c["path"]}: {r.status_code}, {r.elapsed.total_seconds()} сек.'
+                            for c, r in zip(calls, responses))
+        logger.info(f'Выполнено {len(responses)} запросов:\n{timings}')
+        return responses
+
     def with_headers(self, headers: dict):
         self.session.headers.update(headers)
         return self
@@ -71,3 +437,97 @@ class RestfullApiClient(object):
 
     def login(self, method: str, path: str, **credentials) -> Response:
         return self.call_api(method, path, {'json': {**credentials}})
+
+
+class AsyncRestfullApiClient(object):
+    """
+    Асинхронный клиент REST API на основе httpx.AsyncClient с тем же интерфейсом, что и RestfullApiClient.
+    Количество одновременно выполняемых запросов ограничено max_concurrency.
+    """
+    # параметры requests, которые в httpx задаются при создании клиента
+    _client_options = ('verify', 'cert', 'proxies')
+
+    def __init__(self, url, username=None, password=None, max_concurrency: int = 100, timeout: float = 30,
+                 verify=True, cert=None):
+        """
+        Args:
+            url (str): базовый адрес API
+            username (str): имя пользователя
+            password (str): пароль
+            max_concurrency (int): максимальное количество одновременных запросов и соединений
+            timeout (float): таймаут запроса по умолчанию (в секундах)
+            verify: проверка SSL сертификата, аналогично requests
+            cert: клиентский SSL сертификат, аналогично requests
+        """
+        self.url = url
+        self.username = username if username else 'admin'
+        self.password = password if password else 'admin'
+        self.max_concurrency = max_concurrency
+        self.client = httpx.AsyncClient(
+            timeout=timeout, verify=verify, cert=cert,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency))
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def _to_httpx_params(self, data: dict) -> dict:
+        params = dict(data)
+        unsupported = [k for k in params if k in self._client_options + ('stream', 'hooks')]
+        assert not unsupported, f'Параметры {unsupported} не поддерживаются в запросе асинхронного клиента, ' \
+                                f'verify и cert задаются при создании AsyncRestfullApiClient'
+        if 'allow_redirects' in params:
+            params['follow_redirects'] = params.pop('allow_redirects')
+        if isinstance(params.get('data'), (str, bytes)):
+            params['content'] = params.pop('data')
+        return params
+
+    async def call_api(self, method: str, path: str, request_data: dict = None,
+                       log_details: bool = False) -> httpx.Response:
+        """Вызов API запроса, параметры аналогичны RestfullApiClient.call_api
+        Args:
+            method (str): http метод GET, POST и т.д.
+            path (str): путь к ресурсу, например /user/123
+            request_data: параметры запроса params, data, headers, cookies, files, auth, timeout, allow_redirects,
+            json
+            log_details (bool): логировать header и cookies
+
+        Returns: экземпляр класса httpx.Response
+        """
+        if not self._semaphore:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        u = urlsplit(self.url)
+        data = request_data if request_data else {}
+        async with self._semaphore:
+            response = await self.client.request(method, urlunparse((u.scheme, u.netloc, path, '', '', '')),
+                                                 **self._to_httpx_params(data))
+        details = (lambda: (self.client.headers, dict(self.client.cookies), dict(response.cookies))) \
+            if log_details else None
+        _log_api_call(method, f'{self.url}{path}', data, response, details)
+        return response
+
+    async def call_many(self, calls: list, log_details: bool = False) -> list:
+        """Параллельное выполнение API запросов, параметры аналогичны RestfullApiClient.call_many
+
+        Returns: список экземпляров класса httpx.Response в порядке calls
+        """
+        return list(await asyncio.gather(
+            *(self.call_api(c['method'], c['path'], c.get('request_data'), log_details) for c in calls)))
+
+    def with_headers(self, headers: dict):
+        self.client.headers.update(headers)
+        return self
+
+    def with_cookie(self, cookie: str):
+        simple_cookie = http.cookies.SimpleCookie(cookie)
+        self.client.cookies.update({name: morsel.value for name, morsel in simple_cookie.items()})
+        return self
+
+    async def login(self, method: str, path: str, **credentials) -> httpx.Response:
+        return await self.call_api(method, path, {'json': {**credentials}})
@@ -1,21 +1,50 @@
+import atexit
+import hashlib
+import inspect
 import json
+import multiprocessing
 import time
-from time import sleep
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from time import perf_counter, sleep
 
 import allure
 import selenium.webdriver.support.expected_conditions as ec
 from PIL import Image
 from allure_commons.types import AttachmentType
-from pixelmatch.contrib.PIL import pixelmatch
 from selenium.common.exceptions import TimeoutException, StaleElementReferenceException, NoSuchElementException
 from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.remote.webelement import WebElement as WebDriverElement
 from selenium.webdriver.support.wait import WebDriverWait
 
 from qa_testlab import settings
+from qa_testlab.baselines import get_baseline_store, hash_distance
+from qa_testlab.image_diff import compare, compare_png
 from qa_testlab.settings import logger
 from qa_testlab.webdriver.decorators import no_wait
 from qa_testlab.webdriver.driver import get_driver
-from qa_testlab.webdriver.expected_conditions import element_items_not_empty, element_text_not_empty
+from qa_testlab.webdriver.expected_conditions import element_items_not_empty, js_locator, wait_in_browser, \
+    wait_in_browser_for
+from qa_testlab.webdriver.page_objects import HtmlElements
+
+_comparison_executor = None
+
+
+def _get_comparison_executor():
+    """
+    Пул процессов для сравнения скриншотов, None - сравнение выполняется в текущем процессе
+    """
+    global _comparison_executor
+    if settings.screenshot_compare_workers <= 0:
+        return None
+    if not _comparison_executor:
+        # fork процесса с потоками (пул драйверов, пулы соединений) небезопасен: процессы запускаются через
+        # forkserver, а где он недоступен - через spawn
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        _comparison_executor = ProcessPoolExecutor(max_workers=settings.screenshot_compare_workers, mp_context=context)
+        atexit.register(_comparison_executor.shutdown)
+    return _comparison_executor
 
 
 class WebHandler:
@@ -31,10 +60,11 @@ class WebHandler:
     def waits_for_element_to_disappear(self, web_element, timeout=settings.implicit_wait):
         if web_element:
             try:
-                WebDriverWait(self.driver, timeout).until(ec.invisibility_of_element(web_element))
-            except (TimeoutException, StaleElementReferenceException):
-                assert not TimeoutException, f'Элемент {web_element.name} всё еще присутствует ' \
-                                             f'на странице {self.driver.current_url}'
+                disappeared = wait_in_browser(self.driver, web_element, 'invisible', timeout=timeout)
+            except StaleElementReferenceException:  # элемент удалён из DOM
+                disappeared = True
+            assert disappeared, f'Элемент {web_element.name} всё еще присутствует ' \
+                                f'на странице {self.driver.current_url}'
 
     @allure.step("Ожидает появление элемента '{1}'")
     def waits_for_element_to_display(self, web_element, timeout=None):
@@ -50,11 +80,54 @@ class WebHandler:
 
     @allure.step("Ожидает появление не пустого списка {items_attribute} для элемента {element}")
     def waits_for_not_empty_elements_list(self, element, items_attribute='items', timeout=settings.implicit_wait):
+        items = inspect.getattr_static(element, items_attribute, None)
+        locator = js_locator(items.by, items.value) if isinstance(items, HtmlElements) else None
+        if locator and not items._shadow_selector:  # ожидание внутри браузера по локатору списка
+            context = element if items.use_context and isinstance(element, WebDriverElement) else None
+            if not wait_in_browser(self.driver, context, 'not_empty_list', *locator, timeout=timeout):
+                raise TimeoutException(f'Элемент {element.name} содержит пустой список {items_attribute}')
+            return getattr(element, items_attribute)
         try:
             return WebDriverWait(self.driver, timeout).until(element_items_not_empty(element, items_attribute))
         except TimeoutException:
             raise TimeoutException(f'Элемент {element.name} содержит пустой список {items_attribute}')
 
+    def _waits_for_conditions(self, conditions, mode, timeout):
+        is_done, timings = wait_in_browser_for(self.driver, list(conditions), mode=mode, timeout=timeout)
+        report = [{'element': getattr(c[0], 'name', str(c[0])), 'condition': c[1], 'expected': list(c[2:]),
+                   'time': t} for c, t in zip(conditions, timings)]
+        logger.info('Время выполнения условий ожидания (сек.):\n' +
+                    '\n'.join(f'- {r["element"]} {r["condition"]} {r["expected"]}: {r["time"]}' for r in report))
+        if not is_done:
+            failed = json.dumps([r for r in report if r['time'] is None], ensure_ascii=False, indent=2)
+            assert False, f'Условия не выполнены в течение {timeout} сек. на странице {self.driver.current_url}:\n' \
+                          f'{failed}'
+        return report
+
+    @allure.step("Ожидает выполнение всех условий {conditions} в течение {timeout} сек.")
+    def waits_for_all(self, *conditions, timeout=settings.implicit_wait):
+        """
+        Ожидает выполнение всех условий одновременно. Все условия проверяются внутри браузера одним запросом,
+        поэтому общее время ожидания равно времени самого долгого условия, а не их сумме.
+        Args:
+            conditions: кортежи (элемент, условие, ожидаемые значения...), например
+                        (page.title, 'has_text', 'Заголовок'), (page.spinner, 'invisible'), (page.table, 'visible').
+                        Допустимые условия: has_text, contains_text, text_not_empty, text_empty, visible, invisible,
+                        not_empty_list (ожидаемое значение - результат js_locator, например
+                        (page.menu, 'not_empty_list', js_locator(By.CSS_SELECTOR, 'li')))
+            timeout (float): время ожидания (в секундах)
+        Returns: list словарей с временем выполнения каждого условия (в секундах)
+        """
+        return self._waits_for_conditions(conditions, 'all', timeout)
+
+    @allure.step("Ожидает выполнение любого из условий {conditions} в течение {timeout} сек.")
+    def waits_for_any(self, *conditions, timeout=settings.implicit_wait):
+        """
+        Ожидает выполнение любого из условий, см. waits_for_all
+        Returns: list словарей с временем выполнения каждого условия (в секундах), None - условие не выполнено
+        """
+        return self._waits_for_conditions(conditions, 'any', timeout)
+
     @allure.step("Ожидает '{timeout}' сек.")
     def waits_for(self, timeout=1.0):
         sleep(timeout)
@@ -77,6 +150,26 @@ class WebHandler:
     def move_by_offset(self, x, y):
         ActionChains(self.driver).move_by_offset(x, y).perform()
 
+    @staticmethod
+    def _screenshot_filename(element):
+        return element.name.lower().replace(' ', '_').replace('"', '') + '_' + str(int(time.time())) + '.png'
+
+    @allure.step('Скрывает элементы {exclude} в "{element}"')
+    def hides_elements(self, element, exclude: list, timeout=settings.implicit_wait):
+        """
+        Скрывает элементы (visibility: hidden) и дожидается, что они действительно скрыты
+        Args:
+            element (WebElement): элемент, внутри которого ищутся скрываемые элементы
+            exclude (list): список локаторов, например [(By.XPATH, './/div')]
+            timeout (float): время ожидания скрытия элементов (в секундах)
+        """
+        hidden = [e for locator in exclude for e in element.find_elements(*locator)]
+        if not hidden:
+            return
+        self.driver.execute_script("arguments[0].forEach(e => e.style.visibility = 'hidden')", hidden)
+        is_hidden, _ = wait_in_browser_for(self.driver, [(e, 'invisible') for e in hidden], timeout=timeout)
+        assert is_hidden, f'Элементы {exclude} не скрыты в течение {timeout} сек.'
+
     @allure.step('Создаёт скриншот элемента "{element}"')
     def makes_screenshot(self, element, location=None, filename=None):
         """
@@ -89,8 +182,7 @@ class WebHandler:
         Returns: str полный путь к созданному скриншоту
         """
         element.location_once_scrolled_into_view()
-        filename = filename if filename else \
-            element.name.lower().replace(' ', '_').replace('"', '') + '_' + str(int(time.time())) + '.png'
+        filename = filename if filename else self._screenshot_filename(element)
         location = location if location else settings.temp_dir
         screenshot = f'{location}/{filename}'
         assert element.screenshot(screenshot), \
@@ -98,28 +190,28 @@ class WebHandler:
         return screenshot
 
     @allure.step("Сравнивает скриншоты {original_file} и {expected_file}")
-    def compares_images(self, original_file, expected_file, threshold=0.1):
+    def compares_images(self, original_file, expected_file, threshold=0.1, tolerance=None):
         """
-        Сравнивает две картинки и создаёт diff в случае отличий
+        Сравнивает две картинки и создаёт diff в случае отличий. Способ сравнения задаётся settings.image_diff_backend:
+        numpy - векторизованное сравнение qa_testlab.image_diff, pixelmatch - библиотека pixelmatch.
         Args:
             original_file: str путь к оригинальной картинки
             expected_file: str путь к эталонной картинке
             threshold: float 0..1 значение чувствительности, чем меньше значение, тем более чувствительное сравнение
+            tolerance: float допустимый процент отличий, при котором diff не создаётся (для numpy).
+                       None - diff создаётся всегда
+        Returns: tuple (количество отличающихся пикселей, процент отличий, diff или None)
         """
         original = Image.open(str(original_file))
         expected = Image.open(str(expected_file))
-        diff = Image.new("RGBA", original.size)
-
-        mismatch_pixels = pixelmatch(img1=original, img2=expected, output=diff, includeAA=False, threshold=threshold)
-        expected_pixels = expected.size[0] * expected.size[1]
-        mismatch_percentage = (mismatch_pixels / expected_pixels) * 100
-
-        return mismatch_pixels, round(mismatch_percentage, 2), diff
+        return compare(original, expected, threshold=threshold, tolerance=tolerance,
+                       backend=settings.image_diff_backend)
 
     @allure.step('Сравнивает скриншоты "{elements_to_compare}"')
     def compares_element_with_screenshot(self, elements_to_compare: list):
         """
-        Сравнивает скриншоты элементов с эталонными
+        Сравнивает скриншоты элементов с эталонными. Скриншоты снимаются в память, а декодирование и сравнение
+        выполняются в пуле процессов (settings.screenshot_compare_workers) параллельно со снятием следующих скриншотов.
         Args:
             elements_to_compare (dict): протокол (список словарей) передаваемых параметров для сравнения
             [
@@ -134,8 +226,11 @@ class WebHandler:
                exclude: list of tuples список локаторов, которые будут скрыты перед сравнением, например
                         (By.XPATH, './/div[@class='some_class']')
                tolerance: float допустимый процент отличий, значение по умолчанию 0.02
+        Returns: list результатов сравнения в порядке elements_to_compare с временем этапов (в секундах)
         """
-        results = []
+        executor = _get_comparison_executor()
+        store = get_baseline_store()
+        pending = []
         for c in elements_to_compare:
             element = c.get('element') if 'element' in c.keys() else None
             expected_image = c.get('image') if 'image' in c.keys() else None
@@ -147,38 +242,60 @@ class WebHandler:
             assert expected_image, 'Пропущен обязательный параметр "image"'
             expected_image = settings.root_dir / expected_image
 
+            started = perf_counter()
             if exclude:  # исключает элементы перед снятием скриншота
-                for locator in exclude:
-                    for e in element.find_elements(*locator):
-                        self.driver.execute_script("arguments[0].style.visibility='hidden'", e)
-                sleep(1)  # иногда не успевает удалить несколько элементов
-
-            original_image = self.makes_screenshot(element)
-            original_filename = str(original_image).split('/')[-1]
-            expected_filename = str(expected_image).split('/')[-1]
-            diff_filename = original_filename.replace('.png', '_diff.png')
-            diff_image = original_image.replace(original_filename, diff_filename)
-            current_result = {'element': element.name, 'expected': expected_filename, 'original': original_filename,
+                self.hides_elements(element, exclude)
+            element.location_once_scrolled_into_view()
+            original_png = element.screenshot_as_png
+            capture_time = perf_counter() - started
+
+            baseline = store.info(expected_image)
+            if hashlib.sha256(original_png).hexdigest() == baseline['sha256']:  # файлы совпадают, сравнение не нужно
+                comparison = {'mismatch_pixels': 0, 'mismatch_percentage': 0.0, 'diff': None, 'error': None,
+                              'perceptual_hash': baseline['perceptual_hash'], 'compare_time': 0.0}
+            else:
+                compare_args = (original_png, str(expected_image), 0.1, tolerance, settings.image_diff_backend,
+                                baseline['pixel_hash'])
+                comparison = executor.submit(compare_png, *compare_args) if executor else compare_png(*compare_args)
+            current_result = {'element': element.name, 'expected': expected_image.name,
+                              'original': self._screenshot_filename(element),
                               'tolerance': f'допустимый процент отличий {tolerance}%'}
+            pending.append((current_result, tolerance, original_png, expected_image, baseline, comparison,
+                            capture_time))
+
+        results = []
+        failures = []
+        for current_result, tolerance, original_png, expected_image, baseline, comparison, capture_time in pending:
+            started = perf_counter()
+            comparison = comparison if isinstance(comparison, dict) else comparison.result()
+            wait_time = perf_counter() - started
+            original_filename = current_result['original']
+            expected_filename = current_result['expected']
+            diff_filename = original_filename.replace('.png', '_diff.png')
 
-            with open(original_image, 'rb') as f:
-                allure.attach(bytearray(f.read()), name=original_filename + ' (actual)',
-                              attachment_type=AttachmentType.PNG)
-            with open(expected_image, 'rb') as f:
-                allure.attach(bytearray(f.read()), name=expected_filename + ' (expected)',
-                              attachment_type=AttachmentType.PNG)
+            allure.attach(original_png, name=original_filename + ' (actual)', attachment_type=AttachmentType.PNG)
+            failed = bool(comparison['error']) or \
+                (comparison['mismatch_pixels'] != 0 and comparison['mismatch_percentage'] > tolerance)
+            # при отличиях эталон добавляется в отчёт всегда, при совпадении - один раз за запуск
+            if failed or store.attach_once(expected_image):
+                with open(expected_image, 'rb') as f:
+                    allure.attach(bytearray(f.read()), name=expected_filename + ' (expected)',
+                                  attachment_type=AttachmentType.PNG)
 
-            try:
-                comparison_data = self.compares_images(original_image, expected_image)
-            except ValueError as e:  # добавляет ошибку в result и переходит к следующему элементу
+            current_result['perceptual_distance'] = hash_distance(comparison['perceptual_hash'],
+                                                                  baseline['perceptual_hash'])
+            current_result['timings'] = {'capture': round(capture_time, 3),
+                                         'compare': round(comparison['compare_time'], 3),
+                                         'wait': round(wait_time, 3)}
+            results.append(current_result)
+            if comparison['error']:  # добавляет ошибку в result и переходит к следующему элементу
                 current_result.update(
-                    {'result': str(type(e)(str(e) + '\nРазрешение сравниваемых скриншотов неодинаковое.'))})
-                results.append(current_result)
+                    {'result': comparison['error'] + '\nРазрешение сравниваемых скриншотов неодинаковое.'})
+                failures.append(current_result)
                 continue
 
-            mismatch_pixels = comparison_data[0]
-            mismatch_percentage = comparison_data[1]
-            diff = comparison_data[2]
+            mismatch_pixels = comparison['mismatch_pixels']
+            mismatch_percentage = comparison['mismatch_percentage']
 
             if mismatch_pixels != 0:  # логирует сообщение о найденных отличиях, если они есть
                 message = f'Оригинальный скриншот \'{expected_filename}\' отличается на {mismatch_percentage}% ' \
@@ -186,11 +303,16 @@ class WebHandler:
                 logger.info(message)
 
                 if mismatch_percentage > tolerance:  # если найденные отличия больше допустимого процента, то
-                    diff.save(diff_image)  # сохраняет снимок отличий и добавляет сообщение в result
-                    with open(diff_image, 'rb') as f:
-                        allure.attach(bytearray(f.read()), name=diff_filename, attachment_type=AttachmentType.PNG)
+                    location = Path(settings.temp_dir)  # сохраняет снимки и добавляет сообщение в result
+                    location.mkdir(parents=True, exist_ok=True)
+                    (location / original_filename).write_bytes(original_png)
+                    (location / diff_filename).write_bytes(comparison['diff'])
+                    allure.attach(comparison['diff'], name=diff_filename, attachment_type=AttachmentType.PNG)
                     current_result.update({'result': message})
-                    results.append(current_result)  # добавляет проверку элемента в словарь общих результатов проверки
+                    failures.append(current_result)  # добавляет проверку элемента в список несоответствий
 
-        failures_formatted = json.dumps(results, ensure_ascii=False, indent=2)
-        assert results == [], f'Обнаружены несоответствия в следующих скриншотах:\n{failures_formatted}'
+        logger.info('Время этапов сравнения скриншотов (сек.):\n' +
+                    '\n'.join(f'- {r["element"]}: {r["timings"]}' for r in results))
+        failures_formatted = json.dumps(failures, ensure_ascii=False, indent=2)
+        assert failures == [], f'Обнаружены несоответствия в следующих скриншотах:\n{failures_formatted}'
+        return results
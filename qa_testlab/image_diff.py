@@ -0,0 +1,205 @@
+from io import BytesIO
+from time import perf_counter
+
+import numpy as np
+from PIL import Image
+from pixelmatch.contrib.PIL import pixelmatch
+
+from qa_testlab.baselines import get_baseline_store, perceptual_hash, pixel_hash
+
+# смещения соседних пикселей в порядке обхода pixelmatch (по x, затем по y)
+_NEIGHBOURS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx != 0 or dy != 0]
+
+
+def _blend(c, a):
+    # смешивание полупрозрачного цвета с белым
+    return 255 + (c - 255) * a
+
+
+def _rgb2y(r, g, b):
+    return r * 0.29889531 + g * 0.58662247 + b * 0.11448223
+
+
+def _rgb2i(r, g, b):
+    return r * 0.59597799 - g * 0.27417610 - b * 0.32180189
+
+
+def _rgb2q(r, g, b):
+    return r * 0.21147017 - g * 0.52261711 + b * 0.31114694
+
+
+def _blended_channels(rgba):
+    rgb = rgba[..., :3].astype(np.float64)
+    a = rgba[..., 3].astype(np.float64) / 255
+    return _blend(rgb[..., 0], a), _blend(rgb[..., 1], a), _blend(rgb[..., 2], a)
+
+
+def _on_edge(xs, ys, width, height):
+    return ((xs == 0) | (xs == width - 1) | (ys == 0) | (ys == height - 1)).astype(np.int64)
+
+
+def _neighbour(xs, ys, dx, dy, width, height):
+    nx, ny = xs + dx, ys + dy
+    valid = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+    return np.clip(nx, 0, width - 1), np.clip(ny, 0, height - 1), valid
+
+
+def _has_many_siblings(rgba, xs, ys, width, height):
+    """
+    Проверяет, что у пикселей 3 и более соседних пикселя того же цвета
+    """
+    zeroes = _on_edge(xs, ys, width, height)
+    center = rgba[ys, xs]
+    for dx, dy in _NEIGHBOURS:
+        nx, ny, valid = _neighbour(xs, ys, dx, dy, width, height)
+        zeroes += valid & (rgba[ny, nx] == center).all(axis=-1)
+    return zeroes > 2
+
+
+def _antialiased(rgba, brightness, other_rgba, xs, ys, width, height):
+    """
+    Проверяет, являются ли пиксели частью сглаживания (алгоритм pixelmatch, V. Vysniauskas, 2009)
+    """
+    count = len(xs)
+    zeroes = _on_edge(xs, ys, width, height)
+    min_delta, max_delta = np.zeros(count), np.zeros(count)
+    min_x, min_y = np.zeros(count, dtype=np.int64), np.zeros(count, dtype=np.int64)
+    max_x, max_y = np.zeros(count, dtype=np.int64), np.zeros(count, dtype=np.int64)
+    center = brightness[ys, xs]
+    for dx, dy in _NEIGHBOURS:
+        nx, ny, valid = _neighbour(xs, ys, dx, dy, width, height)
+        delta = center - brightness[ny, nx]
+        is_zero = valid & (delta == 0)
+        zeroes += is_zero
+        darker = valid & ~is_zero & (delta < min_delta)
+        brighter = valid & ~is_zero & ~darker & (delta > max_delta)
+        min_delta, min_x, min_y = np.where(darker, delta, min_delta), np.where(darker, nx, min_x), \
+            np.where(darker, ny, min_y)
+        max_delta, max_x, max_y = np.where(brighter, delta, max_delta), np.where(brighter, nx, max_x), \
+            np.where(brighter, ny, max_y)
+    result = (zeroes <= 2) & (min_delta != 0) & (max_delta != 0)
+    if not result.any():
+        return result
+    darkest = _has_many_siblings(rgba, min_x, min_y, width, height) & \
+        _has_many_siblings(other_rgba, min_x, min_y, width, height)
+    brightest = _has_many_siblings(rgba, max_x, max_y, width, height) & \
+        _has_many_siblings(other_rgba, max_x, max_y, width, height)
+    return result & (darkest | brightest)
+
+
+def _draw_diff(rgba, aa_mask, diff_mask, alpha):
+    r, g, b = (rgba[..., i].astype(np.float64) for i in range(3))
+    gray = _blend(_rgb2y(r, g, b), alpha * rgba[..., 3].astype(np.float64) / 255).astype(np.uint8)
+    output = np.empty(rgba.shape, dtype=np.uint8)
+    output[..., 0] = output[..., 1] = output[..., 2] = gray
+    output[..., 3] = 255
+    output[aa_mask] = (255, 255, 0, 255)
+    output[diff_mask] = (255, 0, 0, 255)
+    return Image.fromarray(output, 'RGBA')
+
+
+def _draw_gray(img, alpha):
+    # изображение отличий для одинаковых изображений, аналогично pixelmatch.contrib.PIL
+    rgba = img.convert('RGBA')
+    weight = rgba.getchannel('A').point(lambda x: int(x * alpha))
+    white = Image.new('L', rgba.size, 255)
+    blended = Image.composite(image1=rgba.convert('L'), image2=white, mask=weight)
+    return Image.merge('RGBA', (blended, blended, blended, white))
+
+
+def compare_images(img1: Image.Image, img2: Image.Image, threshold: float = 0.1, include_aa: bool = False,
+                   alpha: float = 0.1, tolerance: float = None):
+    """
+    Векторизованное сравнение изображений с той же метрикой (YIQ), порогом и определением сглаживания, что и
+    pixelmatch. Одинаковые изображения определяются побайтовым сравнением без вычисления разницы.
+    Args:
+        img1: PIL.Image оригинальное изображение
+        img2: PIL.Image эталонное изображение
+        threshold: float 0..1 значение чувствительности, чем меньше значение, тем более чувствительное сравнение
+        include_aa: bool учитывать пиксели сглаживания как отличия
+        alpha: float прозрачность оригинального изображения на изображении отличий
+        tolerance: float допустимый процент отличий. Изображение отличий создаётся, только если процент отличий
+                   больше tolerance. None - изображение отличий создаётся всегда
+    Returns: tuple (количество отличающихся пикселей, процент отличий, PIL.Image изображение отличий или None)
+    """
+    if img1.size != img2.size:
+        raise ValueError('Image sizes do not match.', img1.size, img2.size)
+    width, height = img1.size
+    rgba1 = np.asarray(img1.convert('RGBA'))
+    rgba2 = np.asarray(img2.convert('RGBA'))
+
+    if np.array_equal(rgba1, rgba2):
+        return 0, 0.0, _draw_gray(img1, alpha) if tolerance is None else None
+
+    r1, g1, b1 = _blended_channels(rgba1)
+    r2, g2, b2 = _blended_channels(rgba2)
+    y1, y2 = _rgb2y(r1, g1, b1), _rgb2y(r2, g2, b2)
+    y = y1 - y2
+    i = _rgb2i(r1, g1, b1) - _rgb2i(r2, g2, b2)
+    q = _rgb2q(r1, g1, b1) - _rgb2q(r2, g2, b2)
+    delta = 0.5053 * y * y + 0.299 * i * i + 0.1957 * q * q
+    # 35215 - максимальное значение метрики YIQ
+    ys, xs = np.nonzero(delta > 35215 * threshold * threshold)
+
+    aa = np.zeros(len(xs), dtype=bool)
+    if not include_aa and len(xs):
+        aa = _antialiased(rgba1, y1, rgba2, xs, ys, width, height) | \
+            _antialiased(rgba2, y2, rgba1, xs, ys, width, height)
+
+    mismatch_pixels = int(len(xs) - aa.sum())
+    mismatch_percentage = round(mismatch_pixels / (width * height) * 100, 2)
+    diff = None
+    if tolerance is None or mismatch_percentage > tolerance:
+        aa_mask, diff_mask = np.zeros((height, width), dtype=bool), np.zeros((height, width), dtype=bool)
+        aa_mask[ys[aa], xs[aa]] = True
+        diff_mask[ys[~aa], xs[~aa]] = True
+        diff = _draw_diff(rgba1, aa_mask, diff_mask, alpha)
+    return mismatch_pixels, mismatch_percentage, diff
+
+
+def compare(img1: Image.Image, img2: Image.Image, threshold: float = 0.1, tolerance: float = None,
+            backend: str = 'numpy'):
+    """
+    Сравнивает изображения выбранным способом: numpy (compare_images) или pixelmatch
+    Returns: tuple (количество отличающихся пикселей, процент отличий, PIL.Image изображение отличий или None)
+    """
+    if backend == 'numpy':
+        return compare_images(img1, img2, threshold=threshold, tolerance=tolerance)
+
+    diff = Image.new("RGBA", img1.size)
+    mismatch_pixels = pixelmatch(img1=img1, img2=img2, output=diff, includeAA=False, threshold=threshold)
+    expected_pixels = img2.size[0] * img2.size[1]
+    mismatch_percentage = (mismatch_pixels / expected_pixels) * 100
+    return mismatch_pixels, round(mismatch_percentage, 2), diff
+
+
+def compare_png(original_png: bytes, expected_file: str, threshold: float = 0.1, tolerance: float = None,
+                backend: str = 'numpy', expected_hash: str = None) -> dict:
+    """
+    Декодирует скриншот из PNG байтов и сравнивает его с эталонным файлом. Функция выполняется в отдельном процессе
+    (см. WebHandler.compares_element_with_screenshot), поэтому принимает и возвращает только сериализуемые значения.
+    Эталон берётся из кэша BaselineStore процесса. Если хэш пикселей скриншота совпадает с expected_hash, попиксельное
+    сравнение не выполняется.
+    Returns: dict с ключами mismatch_pixels, mismatch_percentage, diff (PNG байты или None), error (текст ошибки
+             сравнения или None), perceptual_hash скриншота, compare_time (в секундах)
+    """
+    started = perf_counter()
+    result = {'mismatch_pixels': None, 'mismatch_percentage': None, 'diff': None, 'error': None}
+    original = Image.open(BytesIO(original_png))
+    result['perceptual_hash'] = perceptual_hash(original)
+    if expected_hash and pixel_hash(original) == expected_hash:
+        result.update({'mismatch_pixels': 0, 'mismatch_percentage': 0.0, 'compare_time': perf_counter() - started})
+        return result
+    try:
+        mismatch_pixels, mismatch_percentage, diff = compare(
+            original, get_baseline_store().image(expected_file), threshold, tolerance, backend)
+    except ValueError as e:
+        result['error'] = str(e)
+    else:
+        result.update({'mismatch_pixels': mismatch_pixels, 'mismatch_percentage': mismatch_percentage})
+        if diff is not None and mismatch_pixels != 0:
+            buffer = BytesIO()
+            diff.save(buffer, format='PNG')
+            result['diff'] = buffer.getvalue()
+    result['compare_time'] = perf_counter() - started
+    return result
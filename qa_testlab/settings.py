@@ -10,11 +10,27 @@ port = 80
 url = f'{scheme}{host}:{port}'
 rest_port = 55555
 rest_url = f'{scheme}{host}:{rest_port}'
+# логирование REST запросов: размер тела ответа в логе (0 - без ограничения) и доля логируемых успешных запросов
+rest_log_body_limit = int(os.getenv('rest_log_body_limit', 4096))
+rest_log_success_sample_rate = float(os.getenv('rest_log_success_sample_rate', 1.0))
+# запись и воспроизведение ответов REST API: off, record, replay или replay_only (без обращения к API)
+rest_cassette_mode = os.getenv('rest_cassette_mode', 'off')
+rest_cassette_ttl = float(os.getenv('rest_cassette_ttl', 0))  # время жизни записи (в секундах), 0 - без ограничения
 
 # ssh доступ
 ssh_login = 'root'
 ssh_password = 'password'
 ssh_port = 22
+ssh_pool = os.getenv('ssh_pool', 'True').lower() in ('true', '1')  # переиспользование SSH соединений между тестами
+ssh_max_channels = int(os.getenv('ssh_max_channels', 8))  # одновременных каналов (команд) на одно SSH соединение
+ssh_idle_timeout = float(os.getenv('ssh_idle_timeout', 300))  # закрытие неиспользуемого соединения (в секундах)
+# размер сохраняемого вывода stdout и stderr команд (в байтах), 0 - без ограничения
+command_output_limit = int(os.getenv('command_output_limit', 10 * 1024 * 1024))
+command_workers = int(os.getenv('command_workers', 16))  # одновременно выполняемых команд в execute_batch
+transfer_workers = int(os.getenv('transfer_workers', 4))  # одновременно передаваемых файлов при копировании каталогов
+delete_batch_size = int(os.getenv('delete_batch_size', 100))  # файлов, удаляемых в одном SFTP канале за пакет
+# очистка удалённых каталогов одной командой rm -rf / find -delete вместо удаления по SFTP
+remote_bulk_delete = os.getenv('remote_bulk_delete', 'False').lower() in ('true', '1')
 
 root_dir = Path(__file__).parent.parent.resolve()
 temp_dir = root_dir / '.tmp'
@@ -26,8 +42,20 @@ element_wait = float(os.getenv('element_wait', 3))
 browser_name = 'chrome'
 browser_version = None
 local_driver_cache_valid_range = 7  # время жизни кэша локального драйвера в днях
+driver_paths_cache = temp_dir / 'webdriver_paths.json'  # кэш путей локальных драйверов на диске
 grid_url = 'http://192.168.4.79:4444/wd/hub'
 local_run = os.getenv('local_run', 'False').lower() in ('true', '1')
 headless = os.getenv('headless', 'True').lower() in ('true', '1')
+driver_pool_size = int(os.getenv('driver_pool_size', 1))  # максимальное количество сессий браузера в процессе
+driver_max_uses = int(os.getenv('driver_max_uses', 0))  # пересоздание сессии после N использований, 0 - без ограничений
+reuse_session = os.getenv('reuse_session', 'False').lower() in ('true', '1')  # сброс вместо закрытия браузера
+driver_pool_timeout = float(os.getenv('driver_pool_timeout', 60))  # ожидание свободной сессии в пуле (в секундах)
+image_diff_backend = os.getenv('image_diff_backend', 'numpy')  # сравнение скриншотов: numpy или pixelmatch
+# процессы для сравнения скриншотов, 0 - сравнение в текущем процессе
+screenshot_compare_workers = int(os.getenv('screenshot_compare_workers', min(os.cpu_count() or 1, 4)))
+baseline_cache_size = int(os.getenv('baseline_cache_size', 32))  # эталонных скриншотов в памяти процесса
+baseline_index = temp_dir / 'baselines_index.json'  # индекс хэшей эталонных скриншотов
+rest_cassette = Path(os.getenv('rest_cassette', temp_dir / 'rest_cassette.json'))  # файл записанных ответов API
+locator_cache = os.getenv('locator_cache', 'False').lower() in ('true', '1')  # кэш поиска элементов HtmlElement
 
 logger = Logger()
@@ -0,0 +1,78 @@
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException
+from selenium.webdriver.remote.webelement import WebElement
+
+
+class LocatorCache:
+    """
+    Кэш найденных элементов страницы с ключом (контекст поиска, by, value, ...).
+    Сбрасывается при навигации (get, refresh, back, forward) и при HtmlPage.open. Устаревшие элементы из кэша
+    повторно находятся по локатору при получении StaleElementReferenceException: в командах элемента
+    (WebElement._execute) и в скриптах, которым элемент передан аргументом (execute_script, is_displayed,
+    get_attribute, см. WebdriverWrapper.execute).
+    """
+    def __init__(self):
+        self._elements = {}
+        self.hits = 0
+        self.misses = 0
+        self.relocations = 0
+
+    def __len__(self):
+        return len(self._elements)
+
+    def get(self, key):
+        element = self._elements.get(key)
+        if element is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return element
+
+    def put(self, key, element):
+        self._elements[key] = element
+
+    def invalidate(self):
+        self._elements.clear()
+
+    def reset_stats(self):
+        self.hits = self.misses = self.relocations = 0
+
+    @property
+    def stats(self) -> dict:
+        """
+        Returns: dict статистика кэша, hits - количество сэкономленных запросов поиска элемента
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'relocations': self.relocations, 'size': len(self)}
+
+
+def relocate(element) -> bool:
+    """
+    Повторно находит устаревший элемент из кэша локаторов по его локатору
+    Returns: bool True - элемент найден заново, False - элемент не из кэша или не найден
+    """
+    find = getattr(element, '_relocate', None)
+    if not find:
+        return False
+    try:
+        element._id = find().id
+    except (NoSuchElementException, TimeoutException, StaleElementReferenceException):
+        return False
+    cache = getattr(element.parent, 'locator_cache', None)
+    if cache is not None:
+        cache.relocations += 1
+    return True
+
+
+def script_elements(params) -> list:
+    """
+    Элементы из кэша локаторов среди аргументов скрипта команды веб-драйвера
+    """
+    elements, stack = [], list((params or {}).get('args') or [])
+    while stack:
+        arg = stack.pop()
+        if isinstance(arg, (list, tuple)):
+            stack.extend(arg)
+        elif isinstance(arg, dict):
+            stack.extend(arg.values())
+        elif isinstance(arg, WebElement) and getattr(arg, '_relocate', None):
+            elements.append(arg)
+    return elements
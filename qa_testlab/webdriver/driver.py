@@ -1,42 +1,113 @@
+import atexit
 import json
 import os
+import threading
+import weakref
+from pathlib import Path
+from time import monotonic, time
+from urllib.parse import urlsplit
 
 import allure
 from selenium import webdriver
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, WebDriverException
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from webdriver_manager.firefox import GeckoDriverManager
 
 import qa_testlab.settings as settings
+from qa_testlab.webdriver.cache import LocatorCache, relocate, script_elements
 from webdriver_manager.core.driver_cache import DriverCacheManager
 
-_driver_instance = None
+_pool = None
+_pool_lock = threading.Lock()
+_context = threading.local()  # веб-драйвер, закреплённый за текущим потоком
 
+# кэши уровня процесса: пути к локальным драйверам, наборы опций и классы обёрток веб-драйвера
+_driver_paths = {}
+_options = {}
+_wrapper_classes = {}
+_cache_lock = threading.Lock()
 
-def init_driver(browser_name,
-                browser_version=None,
-                is_run_locally=False,
-                headless=True,
-                implicit_wait=settings.implicit_wait,
-                *args, **kwargs):
+
+
+def _read_driver_paths_cache() -> dict:
+    try:
+        with open(settings.driver_paths_cache) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_driver_paths_cache(cache: dict):
+    try:
+        Path(settings.driver_paths_cache).parent.mkdir(parents=True, exist_ok=True)
+        with open(settings.driver_paths_cache, 'w') as f:
+            json.dump(cache, f, indent=2)
+    except OSError as e:
+        settings.logger.warning(f'Не удалось сохранить кэш путей веб-драйверов: {e}')
+
+
+def _install_driver(browser_name):
+    os.environ['WDM_LOCAL'] = '1'
+    os.environ['WDM_SSL_VERIFY'] = '0'
+    if browser_name == 'firefox':
+        return GeckoDriverManager().install()
+    return ChromeDriverManager(
+        cache_manager=DriverCacheManager(valid_range=settings.local_driver_cache_valid_range)
+    ).install()
+
+
+def resolve_driver_path(browser_name, browser_version=None) -> str:
+    """
+    Получает путь к локальному драйверу браузера. Путь кэшируется в памяти процесса и на диске
+    (settings.driver_paths_cache) на settings.local_driver_cache_valid_range дней, поэтому проверка версий через
+    webdriver-manager выполняется только при первом запуске. При недоступности сети используется путь из кэша на диске,
+    даже если срок его действия истёк.
+    Args:
+        browser_name: str название браузера, chrome или firefox
+        browser_version: str версия браузера
+    Returns: str путь к исполняемому файлу драйвера
+    """
+    key = f'{browser_name}:{browser_version or "latest"}'
+    with _cache_lock:
+        if key in _driver_paths:
+            return _driver_paths[key]
+        disk_cache = _read_driver_paths_cache()
+        entry = disk_cache.get(key)
+        is_present = entry is not None and Path(entry['path']).exists()
+        if is_present and time() - entry['resolved_at'] < settings.local_driver_cache_valid_range * 86400:
+            path = entry['path']
+        else:
+            try:
+                path = _install_driver(browser_name)
+            except Exception as e:
+                if not is_present:
+                    raise
+                settings.logger.warning(f'Не удалось обновить драйвер {key}, используется кэш {entry["path"]}: {e}')
+                path = entry['path']
+            else:
+                disk_cache[key] = {'path': path, 'resolved_at': time()}
+                _write_driver_paths_cache(disk_cache)
+        _driver_paths[key] = path
+        return path
+
+
+def _build_options(browser_name, browser_version=None, is_run_locally=False, headless=True):
     driver_class = webdriver.Remote
+    options = None
 
     if browser_name == 'edge':
         options = webdriver.EdgeOptions()
         options.set_capability("ms:edgeOptions", {"args": []})
         if is_run_locally:
             driver_class = webdriver.Edge
-        kwargs.update({'options': options})
 
     if browser_name == 'firefox':
         options = webdriver.FirefoxOptions()
         options.headless = headless
 
         if is_run_locally:
-            os.environ['WDM_LOCAL'] = '1'
-            os.environ['WDM_SSL_VERIFY'] = '0'
             driver_class = webdriver.Firefox
-            kwargs.update({'executable_path': GeckoDriverManager().install()})
         else:
             options.set_capability('browserName', browser_name)
             if browser_version:
@@ -44,7 +115,6 @@ def init_driver(browser_name,
             options.set_capability('acceptInsecureCerts', True)
             options.set_capability('moz:debuggerAddress', True)
             options.set_capability('moz:firefoxOptions', {"args": [f"{'-headless' if headless else None}"]})
-        kwargs.update({'options': options})
 
     if browser_name == 'chrome':
         options = webdriver.ChromeOptions()
@@ -61,27 +131,41 @@ def init_driver(browser_name,
             options.add_argument("headless")
 
         if is_run_locally:
-            os.environ['WDM_LOCAL'] = '1'
-            os.environ['WDM_SSL_VERIFY'] = '0'
             driver_class = webdriver.Chrome
-            kwargs.update({'service': Service(
-                ChromeDriverManager(
-                    cache_manager=DriverCacheManager(valid_range=settings.local_driver_cache_valid_range)
-                ).install()
-            )})
         else:
             options.set_capability('browserName', browser_name)
             if browser_version:
                 options.set_capability('browserVersion', browser_version)
 
-        kwargs.update({'options': options})
+    return driver_class, options
 
-    if not is_run_locally:
-        kwargs.update({"command_executor": settings.grid_url})
 
+def get_options(browser_name, browser_version=None, is_run_locally=False, headless=True):
+    """
+    Получает класс веб-драйвера и опции браузера. Результат кэшируется по названию, версии браузера, режиму запуска
+    и headless.
+    Returns: tuple (класс веб-драйвера, опции браузера)
+    """
+    key = (browser_name, browser_version, is_run_locally, headless)
+    with _cache_lock:
+        if key not in _options:
+            _options[key] = _build_options(*key)
+        return _options[key]
+
+
+def _get_wrapper_class(driver_class):
+    with _cache_lock:
+        if driver_class not in _wrapper_classes:
+            _wrapper_classes[driver_class] = _create_wrapper_class(driver_class)
+        return _wrapper_classes[driver_class]
+
+
+def _create_wrapper_class(driver_class):
     class WebdriverWrapper(driver_class):
-        def __init__(self, implicit_wait=implicit_wait, *args, **kwargs):
+        def __init__(self, implicit_wait=settings.implicit_wait, *args, **kwargs):
             self._implicit_wait = implicit_wait
+            self.locator_cache = LocatorCache()
+            self.visited_origins = set()  # origin открытых страниц для очистки хранилищ при сбросе сессии
             super(WebdriverWrapper, self).__init__(*args, **kwargs)
             super(WebdriverWrapper, self).implicitly_wait(self._implicit_wait)
 
@@ -94,8 +178,32 @@ def init_driver(browser_name,
             response = self.command_executor._request('POST', url, body)
             return response.get('value')
 
+        def execute(self, driver_command, params=None):
+            try:
+                return super().execute(driver_command, params)
+            except StaleElementReferenceException:
+                # устаревшие элементы из кэша локаторов, переданные в скрипт, находятся заново и команда повторяется
+                elements = script_elements(params)
+                if not elements or not all(relocate(e) for e in elements):
+                    raise
+                return super().execute(driver_command, params)
+
+        def get(self, url):
+            self.locator_cache.invalidate()
+            _add_origin(self.visited_origins, url)
+            super().get(url)
+
+        def back(self):
+            self.locator_cache.invalidate()
+            super().back()
+
+        def forward(self):
+            self.locator_cache.invalidate()
+            super().forward()
+
         @allure.step("Перегружает текущую страницу")
         def refresh(self):
+            self.locator_cache.invalidate()
             super().refresh()
 
         def __enter__(self):
@@ -104,34 +212,327 @@ def init_driver(browser_name,
         def __exit__(self, exc_type, exc_val, exc_tb):
             self.close()
 
-    return WebdriverWrapper(*args, **kwargs)
+    return WebdriverWrapper
+
+
+def init_driver(browser_name,
+                browser_version=None,
+                is_run_locally=False,
+                headless=True,
+                implicit_wait=settings.implicit_wait,
+                *args, **kwargs):
+    driver_class, options = get_options(browser_name, browser_version, is_run_locally, headless)
+    kwargs.update({'options': options})
+
+    if is_run_locally and browser_name == 'firefox':
+        kwargs.update({'executable_path': resolve_driver_path(browser_name, browser_version)})
+    if is_run_locally and browser_name == 'chrome':
+        kwargs.update({'service': Service(resolve_driver_path(browser_name, browser_version))})
+
+    if not is_run_locally:
+        kwargs.update({"command_executor": settings.grid_url})
+
+    return _get_wrapper_class(driver_class)(implicit_wait, *args, **kwargs)
+
+
+class DriverPool:
+    """
+    Пул веб-драйверов. Каждый поток получает собственную сессию браузера, освобождённые сессии переиспользуются
+    следующими потоками/тестами. Количество одновременно открытых сессий ограничено max_size, сессия закрывается
+    после max_uses использований (0 - без ограничений). Сессия потока, завершившегося без release_driver/close_driver,
+    возвращается в пул (reclaim) и сбрасывается перед выдачей следующему потоку.
+    """
+    def __init__(self, factory, max_size: int = 1, max_uses: int = 0, timeout: float = 60, reset=None):
+        """
+        Args:
+            factory: callable, создающий новый веб-драйвер
+            reset: callable, сбрасывающий состояние сессии перед возвратом в пул. Должен вернуть False, если
+                   сессия не отвечает, тогда она закрывается и при следующем запросе создаётся новая
+            max_size (int): максимальное количество сессий в пуле
+            max_uses (int): количество использований сессии до её пересоздания, 0 - без ограничений
+            timeout (float): время ожидания свободной сессии (в секундах)
+        """
+        self._factory = factory
+        self.max_size = max_size
+        self.max_uses = max_uses
+        self.timeout = timeout
+        self._reset = reset
+        self._idle = []
+        self._busy = set()
+        self._orphaned = []
+        self._uses = {}
+        self._creating = 0
+        self._condition = threading.Condition()
+
+    @property
+    def size(self):
+        with self._condition:
+            return len(self._idle) + len(self._busy) + len(self._orphaned) + self._creating
+
+    def acquire(self):
+        """
+        Выдаёт свободную сессию из пула или создаёт новую, если размер пула позволяет
+        Returns: веб-драйвер
+        """
+        deadline = monotonic() + self.timeout
+        with self._condition:
+            while not self._idle and not self._orphaned and len(self._busy) + self._creating >= self.max_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise TimeoutException(f'Нет свободного веб-драйвера в пуле (max_size={self.max_size}) '
+                                           f'в течение {self.timeout} сек.')
+                self._condition.wait(remaining)
+            if self._idle:
+                driver = self._idle.pop()
+                self._busy.add(driver)
+                return driver
+            orphan = self._orphaned.pop() if self._orphaned else None
+            if orphan is not None:
+                self._busy.add(orphan)
+            else:
+                self._creating += 1
+        if orphan is not None:
+            expired = self.max_uses and self._uses.get(orphan, 0) >= self.max_uses
+            if not expired and (self._reset(orphan) if self._reset else True):
+                return orphan
+            with self._condition:
+                self._busy.discard(orphan)
+                self._uses.pop(orphan, None)
+                self._creating += 1
+            self._quit(orphan)
+        try:
+            driver = self._factory()
+        except Exception:
+            with self._condition:
+                self._creating -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._creating -= 1
+            self._busy.add(driver)
+            self._uses[driver] = 0
+        return driver
+
+    def release(self, driver):
+        """
+        Возвращает сессию в пул. Сессия, исчерпавшая max_uses или не прошедшая сброс состояния, закрывается.
+        """
+        with self._condition:
+            expired = self.max_uses and self._uses.get(driver, 0) + 1 >= self.max_uses
+        # сессия, исчерпавшая max_uses, закрывается без сброса состояния
+        healthy = self._reset(driver) if self._reset and not expired else True
+        with self._condition:
+            self._busy.discard(driver)
+            self._uses[driver] = self._uses.get(driver, 0) + 1
+            if expired or not healthy:
+                self._uses.pop(driver, None)
+            else:
+                self._idle.append(driver)
+            self._condition.notify()
+        if not healthy:
+            settings.logger.info('Состояние сессии веб-драйвера не сброшено, сессия будет пересоздана')
+            self._quit(driver)
+        elif expired:
+            settings.logger.info(f'Сессия веб-драйвера закрыта после {self.max_uses} использований')
+            self._quit(driver)
+
+    def reclaim(self, driver):
+        """
+        Возвращает в пул сессию потока, завершившегося без её освобождения. Сброс состояния выполняется при следующей
+        выдаче сессии (acquire), а не в завершающемся потоке.
+        """
+        with self._condition:
+            if driver not in self._busy:
+                return
+            self._busy.discard(driver)
+            self._uses[driver] = self._uses.get(driver, 0) + 1
+            self._orphaned.append(driver)
+            self._condition.notify()
+        settings.logger.info('Сессия веб-драйвера завершившегося потока возвращена в пул')
+
+    def shared(self):
+        """
+        Сессия, занятая другим потоком, для совместного использования при max_size=1 (как единственный веб-драйвер
+        процесса без пула)
+        Returns: веб-драйвер или None
+        """
+        with self._condition:
+            return next(iter(self._busy), None) if self.max_size == 1 else None
+
+    def discard(self, driver):
+        """
+        Закрывает сессию и удаляет её из пула
+        """
+        with self._condition:
+            self._busy.discard(driver)
+            if driver in self._idle:
+                self._idle.remove(driver)
+            if driver in self._orphaned:
+                self._orphaned.remove(driver)
+            self._uses.pop(driver, None)
+            self._condition.notify()
+        self._quit(driver)
+
+    def close_all(self):
+        with self._condition:
+            drivers = self._idle + self._orphaned + list(self._busy)
+            self._idle, self._orphaned, self._busy, self._uses = [], [], set(), {}
+            self._condition.notify_all()
+        for driver in drivers:
+            self._quit(driver)
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception as e:
+            settings.logger.warning(f'Ошибка при закрытии веб-драйвера: {e}')
+
+
+def _create_driver():
+    driver = init_driver(
+        browser_name=settings.browser_name,
+        browser_version=settings.browser_version,
+        is_run_locally=settings.local_run,
+        headless=settings.headless,
+        implicit_wait=settings.implicit_wait
+    )
+    driver.maximize_window()
+    driver.set_window_size(1920, 1080)
+    driver.implicitly_wait(settings.implicit_wait)
+    return driver
+
+
+def _add_origin(origins: set, url: str):
+    u = urlsplit(url)
+    if u.scheme in ('http', 'https') and u.netloc:
+        origins.add(f'{u.scheme}://{u.netloc}')
+
+
+def reset_driver(driver) -> bool:
+    """
+    Сбрасывает состояние сессии браузера без её закрытия: закрывает все окна, открывая вместо них новую вкладку
+    (sessionStorage), очищает cookies, кэш и хранилища (localStorage, IndexedDB, Cache Storage, service workers)
+    всех посещённых origin через CDP и открывает about:blank. Хранилища других origin без CDP не очищаются, поэтому
+    сессии браузеров, кроме chrome, не сбрасываются, а пересоздаются.
+    Args:
+        driver: веб-драйвер
+    Returns: bool True - состояние сброшено, False - сессия должна быть пересоздана (не отвечает или сброс
+             не поддерживается браузером)
+    """
+    if settings.browser_name != 'chrome':
+        return False
+    try:
+        origins = getattr(driver, 'visited_origins', set())
+        handles = driver.window_handles  # проверка, что сессия отвечает
+        for handle in handles:
+            driver.switch_to.window(handle)
+            _add_origin(origins, driver.current_url)
+        driver.switch_to.new_window('tab')
+        blank = driver.current_window_handle
+        for handle in handles:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(blank)
+        for origin in origins:
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin', {'origin': origin, 'storageTypes': 'all'})
+        origins.clear()
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        driver.execute_cdp_cmd('Network.clearBrowserCache', {})
+        driver.get('about:blank')
+        driver.implicitly_wait(settings.implicit_wait)
+        return driver.execute_script('return document.readyState') == 'complete'
+    except (WebDriverException, IndexError) as e:
+        settings.logger.warning(f'Ошибка при сбросе состояния веб-драйвера: {e}')
+        return False
+
+
+def get_pool() -> DriverPool:
+    global _pool
+    with _pool_lock:
+        if not _pool:
+            _pool = DriverPool(_create_driver,
+                               max_size=settings.driver_pool_size,
+                               max_uses=settings.driver_max_uses,
+                               timeout=settings.driver_pool_timeout,
+                               reset=reset_driver)
+        return _pool
+
+
+class _SessionOwner:
+    """
+    Маркер владения сессией потоком: удаляется вместе с данными threading.local при завершении потока, после чего
+    незакрытая сессия возвращается в пул (DriverPool.reclaim)
+    """
+
+
+def _attach_driver(driver, shared=False):
+    _context.driver = driver
+    _context.shared = shared
+    _context.owner = None if shared else _SessionOwner()
+    _context.finalizer = None if shared else weakref.finalize(_context.owner, get_pool().reclaim, driver)
+    if _context.finalizer:
+        _context.finalizer.atexit = False
+
+
+def _detach_driver():
+    """
+    Открепляет веб-драйвер от текущего потока
+    Returns: веб-драйвер потока или None, если его нет или он используется совместно с другим потоком
+    """
+    driver = getattr(_context, 'driver', None)
+    if getattr(_context, 'finalizer', None):
+        _context.finalizer.detach()
+    shared = getattr(_context, 'shared', False)
+    _context.driver = _context.owner = _context.finalizer = None
+    _context.shared = False
+    return None if shared else driver
 
 
 def get_driver():
-    global _driver_instance
-    if not _driver_instance:
-        _driver_instance = init_driver(
-            browser_name=settings.browser_name,
-            browser_version=settings.browser_version,
-            is_run_locally=settings.local_run,
-            headless=settings.headless,
-            implicit_wait=settings.implicit_wait
-        )
-        _driver_instance.maximize_window()
-        _driver_instance.set_window_size(1920, 1080)
-        _driver_instance.implicitly_wait(settings.implicit_wait)
-    return _driver_instance
+    driver = getattr(_context, 'driver', None)
+    if not driver:
+        pool = get_pool()
+        driver = pool.shared()
+        if driver:
+            _attach_driver(driver, shared=True)
+        else:
+            driver = pool.acquire()
+            _attach_driver(driver)
+    return driver
 
 
 def get_driver_no_init():
-    return _driver_instance
+    return getattr(_context, 'driver', None)
+
+
+def release_driver():
+    """
+    Открепляет веб-драйвер от текущего потока, сбрасывает состояние сессии и возвращает её в пул для переиспользования
+    """
+    driver = _detach_driver()
+    if driver:
+        get_pool().release(driver)
 
 
 def close_driver():
-    global _driver_instance
-    if _driver_instance:
-        _driver_instance.quit()
-        _driver_instance = None
+    """
+    Закрывает веб-драйвер текущего потока. Если settings.reuse_session = True, то сессия не закрывается, а сбрасывается
+    и возвращается в пул (см. release_driver).
+    """
+    if settings.reuse_session:
+        return release_driver()
+    driver = _detach_driver()
+    if driver:
+        get_pool().discard(driver)
+
+
+def close_all_drivers():
+    if _pool:
+        _pool.close_all()
+
+
+atexit.register(close_all_drivers)
 
 class WebdriverContext:
     def __init__(self, driver=None):
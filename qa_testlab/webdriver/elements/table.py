@@ -2,11 +2,70 @@ import allure
 from selenium.webdriver.common.by import By
 
 from qa_testlab.settings import logger
+from qa_testlab.webdriver.expected_conditions import js_locator
 from qa_testlab.webdriver.page_objects import WebElement, HtmlElement, HtmlElements
 
+# поиск элементов внутри браузера по результату js_locator относительно элемента context, как find_elements
+_FIND_SCRIPT = """
+const find = (context, locator) => {
+    if (locator[0] === 'xpath') {
+        const found = document.evaluate(locator[1], context, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        return Array.from({length: found.snapshotLength}, (_, i) => found.snapshotItem(i));
+    }
+    return Array.from(context.querySelectorAll(locator[1]));
+};
+// текст как у WebElement.text: неразрывные пробелы заменяются обычными, у ячеек без отображения (display: none) -
+// пустая строка
+const text = c => c.getClientRects().length > 0 ? (c.innerText || '').replace(/\\u00a0/g, ' ').trim() : '';
+"""
+
+# тексты ячеек по локатору относительно элемента (arguments[0]) за один вызов
+_CELLS_TEXT_SCRIPT = _FIND_SCRIPT + """
+return find(arguments[0], arguments[1]).map(text);
+"""
+
+# заголовок и матрица значений таблицы за один вызов, заголовок - первый найденный элемент, как у HtmlElement
+_TABLE_TEXT_SCRIPT = _FIND_SCRIPT + """
+const [table, headerLocator, headerCellsLocator, rowsLocator, rowCellsLocator] = arguments;
+const header = find(table, headerLocator)[0];
+return {
+    header: header ? find(header, headerCellsLocator).map(text) : [],
+    rows: find(table, rowsLocator).map(r => find(r, rowCellsLocator).map(text))
+};
+"""
+
+
+def _descriptor(cls, name: str):
+    """
+    Дескриптор HtmlElement или HtmlElements атрибута name класса cls (без поиска элемента)
+    Returns: HtmlElement или None
+    """
+    for klass in getattr(cls, '__mro__', ()):
+        if name in vars(klass):
+            descriptor = vars(klass)[name]
+            return descriptor if isinstance(descriptor, HtmlElement) else None
+    return None
+
+
+def _bulk_locator(descriptor):
+    """
+    Локатор дескриптора для поиска внутри браузера
+    Returns: list ['css' или 'xpath', селектор] или None, если локатор не преобразуется (неподдерживаемый By,
+        shadow_selector, поиск вне контекста)
+    """
+    if descriptor is None or descriptor._shadow_selector or not descriptor.use_context:
+        return None
+    locator = js_locator(descriptor.by, descriptor.value)
+    return list(locator) if locator else None
+
 
 class TableHeader(WebElement):
+    """
+    Заголовок таблицы. В режиме bulk (по умолчанию) значения читаются одним вызовом execute_script по локатору items,
+    если он не преобразуется для поиска внутри браузера - поэлементно.
+    """
     items = HtmlElements('Поля заголовка таблицы', By.CSS_SELECTOR, 'tr th')
+    bulk = True  # False - значения читаются поэлементно через items
 
     def __repr__(self):
         return 'Заголовок таблицы'
@@ -17,6 +76,9 @@ class TableHeader(WebElement):
 
     @property
     def values(self):
+        locator = _bulk_locator(_descriptor(type(self), 'items')) if self.bulk else None
+        if locator:
+            return self.parent.execute_script(_CELLS_TEXT_SCRIPT, self, locator)
         items = self.items
         return [i.text for i in items] if len(items) > 0 else []
 
@@ -37,22 +99,52 @@ class TableRow(TableHeader):
 
 class Table(WebElement):
     """
-    Класс представляющий элемент веб-интерфейса Table (таблица)
+    Класс представляющий элемент веб-интерфейса Table (таблица).
+    В режиме bulk (по умолчанию) заголовок и значения таблицы читаются одним вызовом execute_script по локаторам
+    header, rows и items их типов (переопределённые в наследниках локаторы учитываются), экземпляры TableRow
+    создаются только при обращении к rows. Если какой-либо локатор не преобразуется для поиска внутри браузера
+    (см. js_locator), значения читаются поэлементно.
     """
 
     header = HtmlElement('Заголовок таблицы', By.TAG_NAME, 'thead', ui_type=TableHeader)
     rows = HtmlElements('Строки таблицы', By.CSS_SELECTOR, 'tbody tr', ui_type=TableRow)
+    bulk = True  # False - значения читаются поэлементно через rows и header
+
+    def _bulk_locators(self):
+        """
+        Локаторы заголовка, его ячеек, строк и их ячеек для чтения таблицы одним вызовом
+        Returns: list или None, если чтение одним вызовом невозможно
+        """
+        header, rows = _descriptor(type(self), 'header'), _descriptor(type(self), 'rows')
+        locators = [_bulk_locator(header), _bulk_locator(_descriptor(getattr(header, 'ui_type', None), 'items')),
+                    _bulk_locator(rows), _bulk_locator(_descriptor(getattr(rows, 'ui_type', None), 'items'))]
+        return None if None in locators else locators
+
+    def _scrape(self) -> dict:
+        """
+        Получает заголовок и значения таблицы
+        Returns: dict {'header': [...], 'rows': [[...], ...]}
+        """
+        locators = self._bulk_locators() if self.bulk else None
+        if locators:
+            data = self.parent.execute_script(_TABLE_TEXT_SCRIPT, self, *locators)
+            # строки могут ещё загружаться: поиск rows (find_elements) ожидает их в пределах неявного ожидания
+            if not data['rows'] and len(self.rows) > 0:
+                data = self.parent.execute_script(_TABLE_TEXT_SCRIPT, self, *locators)
+            return data
+        header = self.header
+        return {'header': header.values if header else [], 'rows': [r.values for r in self.rows]}
 
     @property
     def values(self):
-            return [r.values for r in self.rows]
+        return self._scrape()['rows']
 
     @property
     def columns(self):
         table = {}
-        rows = [r.values for r in self.rows]
-        for i, k in enumerate(self.header.values):
-            column = [r[i] for r in rows]
+        data = self._scrape()
+        for i, k in enumerate(data['header']):
+            column = [r[i] if i < len(r) else None for r in data['rows']]
             table.update({k: column})
         return table
 
@@ -61,11 +153,12 @@ class Table(WebElement):
         return len(self.rows)
 
     def get_column(self, name: str):
-        column = [c for c in self.columns if c.name == f'Колонка "{name}"']
-        assert len(column) > 0, f'Колонка с названием {name} не найдена.'
-        if len(column) > 1:
+        data = self._scrape()
+        indexes = [i for i, k in enumerate(data['header']) if k == name]
+        assert len(indexes) > 0, f'Колонка с названием {name} не найдена.'
+        if len(indexes) > 1:
             logger.warn(f'Колонок с именем "{name}" больше, чем одна.')
-        return column[0]
+        return [r[indexes[0]] if indexes[0] < len(r) else None for r in data['rows']]
 
     @allure.step("{0} содержит {size} строк")
     def has_size(self, size: int):
@@ -73,10 +166,9 @@ class Table(WebElement):
 
     @allure.step('Получает строку таблицы по значению {value} колонки {column}')
     def get_row_by_value(self, column: str, value: str) -> TableRow:
-        for i, r in enumerate(self.get_column(column)):
-            if r.text == value:
-                row_num = i
-                return self.rows[row_num]
+        for i, v in enumerate(self.get_column(column)):
+            if v == value:
+                return self.rows[i]  # живые элементы строк запрашиваются только для найденного значения
 
     @allure.step('Проверяет, что строк в {0} больше чем {rows_greater_than}')
     def is_not_empty(self, rows_greater_than: int = 0):
@@ -96,13 +188,14 @@ class Table(WebElement):
             'Допустимые параметры rows и/или columns, формат значений - вложенный список'
         columns = kwargs.get('columns') if 'columns' in kwargs.keys() else None
         rows = kwargs.get('rows') if 'rows' in kwargs.keys() else None
+        data = self._scrape() if columns or rows else None
         if columns:
-            table_columns = sorted(self.header.values) if in_any_order else self.header.values
+            table_columns = sorted(data['header']) if in_any_order else data['header']
             expected_columns = sorted(columns) if in_any_order else columns
             assert table_columns == expected_columns, \
                 f'Колонки "{table_columns}" в "{self.name}" не соответствуют ожидаемым: {columns}'
         if rows:
-            table_values = sorted(self.values) if in_any_order else self.values
+            table_values = sorted(data['rows']) if in_any_order else data['rows']
             expected_values = sorted(rows) if in_any_order else rows
             assert table_values == expected_values, \
                 f'Значения "{table_values}" в "{self.name}" не соответствуют ожидаемым: {expected_values}'
\ No newline at end of file
@@ -1,7 +1,185 @@
-from time import sleep
+from time import monotonic, sleep
 
+from selenium.common.exceptions import JavascriptException
+from selenium.webdriver.common.by import By
 from selenium.webdriver.remote.webelement import WebElement
 
+# стандартный (W3C) таймаут асинхронных скриптов в секундах
+DEFAULT_SCRIPT_TIMEOUT = 30
+
+# ожидание условий внутри браузера: проверка выполняется при каждом изменении DOM (MutationObserver) и по интервалу
+# (для изменений стилей без мутаций DOM), результат возвращается одним запросом по выполнении условий или по таймауту.
+# Для каждого условия возвращается время (в мс) от начала ожидания до его первого выполнения
+_WAIT_CONDITIONS_SCRIPT = """
+const conditions = arguments[0], mode = arguments[1], timeout = arguments[2];
+const done = arguments[arguments.length - 1];
+const started = performance.now();
+// текст как WebElement.text: неразрывные пробелы заменяются обычными, у элементов без отображения (display: none,
+// отсоединённых от документа) - пустой
+const text = element => element && element.getClientRects().length > 0
+    ? (element.innerText || '').replace(/\\u00a0/g, ' ').trim() : '';
+const isVisible = element => {
+    if (!element || !element.isConnected || element.getClientRects().length === 0) {
+        return false;
+    }
+    return window.getComputedStyle(element).visibility !== 'hidden';
+};
+const count = (element, locator) => {
+    const context = element || document;
+    if (locator[0] === 'xpath') {
+        return document.evaluate(
+            locator[1], context, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null).snapshotLength;
+    }
+    return context.querySelectorAll(locator[1]).length;
+};
+const checks = {
+    has_text: (element, expected) => expected.some(t => text(element) === t),
+    contains_text: (element, expected) => expected.some(t => text(element).includes(t)),
+    text_not_empty: element => text(element).length > 0,
+    text_empty: element => text(element).length === 0,
+    visible: element => isVisible(element),
+    invisible: element => !isVisible(element),
+    not_empty_list: (element, expected) => count(element, expected) > 0
+};
+const timings = conditions.map(() => null);
+let finished = false, observer = null, poll = null, timer = null;
+const finish = ok => {
+    if (finished) {
+        return;
+    }
+    finished = true;
+    observer.disconnect();
+    clearInterval(poll);
+    clearTimeout(timer);
+    done({ok: ok, timings: timings});
+};
+const check = () => {
+    const results = conditions.map(([element, condition, expected], i) => {
+        let result = false;
+        try {
+            result = checks[condition](element, expected);
+        } catch (e) {
+            result = false;
+        }
+        if (result && timings[i] === null) {
+            timings[i] = performance.now() - started;
+        }
+        return result;
+    });
+    if (mode === 'any' ? results.some(r => r) : results.every(r => r)) {
+        finish(true);
+    }
+};
+observer = new MutationObserver(check);
+observer.observe(document.documentElement, {subtree: true, childList: true, characterData: true, attributes: true});
+poll = setInterval(check, 100);
+timer = setTimeout(() => finish(false), timeout * 1000);
+check();
+"""
+
+CONDITIONS = ('has_text', 'contains_text', 'text_not_empty', 'text_empty', 'visible', 'invisible', 'not_empty_list')
+
+
+def js_locator(by: str, value: str):
+    """
+    Преобразует локатор selenium в css селектор или xpath для поиска внутри браузера
+    Returns: tuple ('css' или 'xpath', селектор) или None, если локатор не поддерживается
+    """
+    if by == By.CSS_SELECTOR:
+        return 'css', value
+    if by == By.TAG_NAME:
+        return 'css', value
+    if by == By.CLASS_NAME:
+        return 'css', f'.{value}'
+    if by == By.ID:
+        return 'css', f'[id="{value}"]'
+    if by == By.NAME:
+        return 'css', f'[name="{value}"]'
+    if by == By.XPATH:
+        return 'xpath', value
+    return None
+
+
+def _expected(condition: str, expected: tuple) -> list:
+    # для not_empty_list результат js_locator принимается как одним аргументом, так и распакованным (*js_locator())
+    if condition == 'not_empty_list' and len(expected) == 1 and isinstance(expected[0], (list, tuple)):
+        return list(expected[0])
+    return list(expected)
+
+
+def wait_in_browser_for(driver, conditions: list, mode: str = 'all', timeout: float = 0):
+    """
+    Ожидает выполнение всех (mode='all') или любого (mode='any') из условий внутри браузера за один запрос
+    Args:
+        driver: веб-драйвер
+        conditions: list кортежей (элемент, условие, ожидаемые значения...), см. wait_in_browser
+        mode: str all или any
+        timeout: float время ожидания (в секундах)
+    Returns: tuple (bool результат ожидания, list времени выполнения каждого условия в секундах или None)
+    При переходе страницы на другой документ во время ожидания условия invisible считаются выполненными, остальные
+    условия ожидаются на новом документе в пределах timeout.
+    """
+    assert mode in ('all', 'any'), 'Допустимые значения mode: all, any'
+    for c in conditions:
+        assert c[1] in CONDITIONS, f'Неизвестное условие "{c[1]}". Допустимые условия: {CONDITIONS}'
+    started = monotonic()
+    timings = [None] * len(conditions)
+    pending = list(range(len(conditions)))
+    while True:
+        offset = monotonic() - started
+        try:
+            ok, run_timings = _run_wait_script(driver, [conditions[i] for i in pending], mode, max(timeout - offset, 0))
+        except JavascriptException as e:
+            # страница перешла на другой документ во время ожидания (например, отправка формы): элементы прежнего
+            # документа считаются скрытыми, остальные условия ожидаются на новом документе
+            if 'unload' not in str(e).lower():
+                raise
+            offset = monotonic() - started
+            for i in [i for i in pending if conditions[i][1] == 'invisible']:
+                timings[i] = offset
+            pending = [i for i in pending if conditions[i][1] != 'invisible']
+            if not pending or (mode == 'any' and len(pending) < len(conditions)):
+                return True, timings
+            if offset >= timeout:
+                return False, timings
+            continue
+        for i, t in zip(pending, run_timings):
+            timings[i] = t + offset if t is not None else None
+        return ok, timings
+
+
+def _run_wait_script(driver, conditions: list, mode: str, timeout: float):
+    script_args = [[c[0], c[1], _expected(c[1], c[2:])] for c in conditions]
+    script_timeout = None
+    if timeout + 1 >= DEFAULT_SCRIPT_TIMEOUT:
+        script_timeout = driver.timeouts.script
+        driver.set_script_timeout(timeout + 1)
+    try:
+        result = driver.execute_async_script(_WAIT_CONDITIONS_SCRIPT, script_args, mode, timeout)
+    finally:
+        if script_timeout is not None:
+            driver.set_script_timeout(script_timeout)
+    return bool(result['ok']), [t / 1000 if t is not None else None for t in result['timings']]
+
+
+def wait_in_browser(driver, element, condition: str, *expected, timeout: float = 0) -> bool:
+    """
+    Ожидает выполнение условия для элемента внутри браузера за один запрос (без опроса со стороны теста)
+    Args:
+        driver: веб-драйвер
+        element: WebElement элемент страницы (для условия not_empty_list может быть None - поиск в документе)
+        condition: str условие: has_text, contains_text, text_not_empty, text_empty, visible, invisible,
+                   not_empty_list
+        expected: ожидаемые значения: тексты для has_text / contains_text, результат js_locator для not_empty_list
+                  (кортеж или распакованные значения)
+        timeout: float время ожидания (в секундах)
+    Returns: bool True - условие выполнено, False - истёк таймаут
+    Текст элемента - innerText без пробелов в начале и конце и с заменой неразрывных пробелов обычными, у скрытых
+    элементов (display: none, вне документа) текст пустой, как у WebElement.text. В отличие от WebElement.text
+    элементы с opacity: 0 считаются отображаемыми.
+    """
+    return wait_in_browser_for(driver, [(element, condition, *expected)], timeout=timeout)[0]
+
 
 class elements_list_not_empty(object):
     def __init__(self, locator: tuple, pooling_timeout=0):
@@ -40,7 +218,7 @@ class element_text_not_empty(object):
             pooling_timeout: float время повторного опроса (в миллисекундах)
         """
         self.element = element
-        self.pooling_timeout = pooling_timeout / 100
+        self.pooling_timeout = pooling_timeout / 1000
 
     def __call__(self, driver):
         sleep(self.pooling_timeout)
@@ -60,7 +238,7 @@ class element_text_empty(object):
             pooling_timeout: float время повторного опроса (в миллисекундах)
         """
         self.element = element
-        self.pooling_timeout = pooling_timeout / 100
+        self.pooling_timeout = pooling_timeout / 1000
 
     def __call__(self, driver):
         sleep(self.pooling_timeout)
@@ -5,16 +5,39 @@ from types import MethodType
 from typing import TypeVar
 
 import allure
-from selenium.common.exceptions import NoSuchElementException, TimeoutException, InvalidElementStateException
+from selenium.common.exceptions import NoSuchElementException, TimeoutException, InvalidElementStateException, \
+    StaleElementReferenceException
 from selenium.webdriver import ActionChains
 from selenium.webdriver.remote.webelement import WebElement as WebDriverElement
 from selenium.webdriver.support import expected_conditions as ec
 from selenium.webdriver.support.wait import WebDriverWait
 
 import qa_testlab.settings as settings
+from qa_testlab.webdriver.cache import relocate
 from qa_testlab.webdriver.decorators import no_wait
 from qa_testlab.webdriver.driver import get_driver
-from qa_testlab.webdriver.expected_conditions import element_contains_text, element_has_text
+from qa_testlab.webdriver.expected_conditions import element_contains_text, element_has_text, wait_in_browser
+
+# значения для всех элементов списка (arguments[0]) за один вызов execute_script, текст как у WebElement.text:
+# неразрывные пробелы заменяются обычными, у элементов без отображения (display: none, отсоединённых от документа) -
+# пустая строка
+_TEXTS_SCRIPT = """
+return arguments[0].map(e => e.getClientRects().length > 0 ? (e.innerText || '').replace(/\\u00a0/g, ' ').trim() : '');
+"""
+_PROPERTIES_SCRIPT = "return arguments[0].map(e => e[arguments[1]]);"
+# аналог WebElement.get_attribute: значение свойства, если оно задано, иначе значение атрибута тега
+_ATTRIBUTES_SCRIPT = """
+return arguments[0].map(e => {
+    const value = e[arguments[1]];
+    if (value === undefined || value === null || typeof value === 'object' || typeof value === 'function') {
+        return e.getAttribute(arguments[1]);
+    }
+    if (typeof value === 'boolean') {
+        return value ? 'true' : null;
+    }
+    return String(value);
+});
+"""
 
 
 def is_element_present(self, element_name, timeout=0):
@@ -24,7 +47,7 @@ def is_element_present(self, element_name, timeout=0):
         if isinstance(element, list):
             return all(e.is_displayed() for e in element)
         return element.is_displayed()
-    except (AttributeError, NoSuchElementException):
+    except (AttributeError, NoSuchElementException, StaleElementReferenceException):
         return False
     finally:
         get_driver().implicitly_wait(settings.implicit_wait)
@@ -49,6 +72,15 @@ class WebElement(WebDriverElement):
     def __repr__(self):
         return self._name
 
+    def _execute(self, command, params=None):
+        try:
+            return super()._execute(command, params)
+        except StaleElementReferenceException:
+            # элементы из кэша локаторов повторно находятся по локатору, остальные пробрасывают исключение
+            if not relocate(self):
+                raise
+            return super()._execute(command, params)
+
     @property
     def int(self):
         return int(self.text.replace(' ', ''))
@@ -116,22 +148,33 @@ class WebElement(WebDriverElement):
     def click_and_hold(self):
         ActionChains(get_driver()).click_and_hold().release(self).perform()
 
+    def _wait_for_text(self, condition: str, text: tuple, timeout: float) -> bool:
+        """
+        Ожидает текст элемента внутри браузера (innerText без пробелов в начале и конце, для элементов без
+        отображения - пустая строка, как WebElement.text). Если свойство text переопределено в наследнике
+        (например, TableHeader), ожидание выполняется опросом переопределённого text.
+        """
+        if type(self).text is WebElement.text:
+            return wait_in_browser(self.parent, self, condition, *text, timeout=timeout)
+        expected = element_has_text if condition == 'has_text' else element_contains_text
+        try:
+            WebDriverWait(self.parent, timeout).until(expected(self, *text))
+            return True
+        except TimeoutException:
+            return False
+
     @no_wait
     @allure.step("Текст элемента '{0}' соответствует '{1}'")
     def has_text(self, *text: str, timeout=None):
         timeout = timeout if timeout else settings.short_implicit_wait
-        try:
-            WebDriverWait(self.parent, timeout).until(element_has_text(self, *text))
-        except TimeoutException:
+        if not self._wait_for_text('has_text', text, timeout):
             assert False, f'Ожидаемый текст "{text}" не соответствует тексту "{self.text}" элемента "{self.name}"'
 
     @no_wait
     @allure.step("Текст '{1}' содержится в тексте элемента '{0}'")
     def contains_text(self, *text: str, timeout=None):
         timeout = timeout if timeout else settings.short_implicit_wait
-        try:
-            WebDriverWait(self.parent, timeout).until(element_contains_text(self, *text))
-        except TimeoutException:
+        if not self._wait_for_text('contains_text', text, timeout):
             assert False, f'Ожидаемый текст "{text}" не содержится в тексте "{self.text}" элемента "{self.name}"'
 
     @allure.step("Элемент '{0}' содержит значение атрибута {attribute} = {value}")
@@ -175,6 +218,36 @@ class WebElementsList(UserList):
     def __repr__(self):
         return self._name
 
+    def _execute_for_all(self, script, *args) -> list:
+        if len(self.iterable) == 0:
+            return []
+        return self.iterable[0].parent.execute_script(script, list(self.iterable), *args)
+
+    def texts(self) -> list:
+        """
+        Получает тексты всех элементов списка одним запросом к браузеру
+        Returns: list текстов в порядке элементов списка, для скрытых элементов - пустая строка (как WebElement.text)
+        """
+        return self._execute_for_all(_TEXTS_SCRIPT)
+
+    def attributes(self, name: str) -> list:
+        """
+        Получает значения атрибута всех элементов списка одним запросом к браузеру, аналогично get_attribute
+        Args:
+            name (str): название атрибута
+        Returns: list значений в порядке элементов списка
+        """
+        return self._execute_for_all(_ATTRIBUTES_SCRIPT, name)
+
+    def properties(self, name: str) -> list:
+        """
+        Получает значения свойства всех элементов списка одним запросом к браузеру, аналогично get_property
+        Args:
+            name (str): название свойства
+        Returns: list значений в порядке элементов списка
+        """
+        return self._execute_for_all(_PROPERTIES_SCRIPT, name)
+
     def has_size(self, size: int, attribute: str=None):
         """
         Сравнивает количество элементов в списке
@@ -202,11 +275,12 @@ class WebElementsList(UserList):
         """
         types = ['tag', 'class']
         assert attribute_type.lower() in types, f'Неверное значение attribute_type. Допустимые типы: {types}'
-        if attribute == 'text' and attribute_type=='tag':
-            original_values = [x.text for x in self.iterable]
+        if attribute == 'text' and attribute_type.lower() == 'tag':
+            original_values = self.texts()
+        elif attribute_type.lower() == 'tag':
+            original_values = self.attributes(attribute)
         else:
-            original_values = [x.get_attribute(attribute) if attribute_type.lower() == 'tag'
-                else getattr(x, attribute).text for x in self.iterable]
+            original_values = [getattr(x, attribute).text for x in self.iterable]
         expected_values = list(values)
 
         if in_any_order:
@@ -218,11 +292,11 @@ class WebElementsList(UserList):
 
     @allure.step("Значения элемента '{0}' не содержат текст '{text}'")
     def has_no_text(self, text):
-        assert text not in [e.text for e in self.iterable], f'"{self.name}" не должен содержать текст "{text}"'
+        assert text not in self.texts(), f'"{self.name}" не должен содержать текст "{text}"'
 
     @allure.step("Значения элемента '{0}' содержат текст '{text}'")
     def has_text(self, text):
-        assert text in [e.text for e in self.iterable], f'"{self.name}" не содержит текст "{text}"'
+        assert text in self.texts(), f'"{self.name}" не содержит текст "{text}"'
 
 
 class HtmlPage(object):
@@ -242,6 +316,9 @@ class HtmlPage(object):
     def open(self):
         if not self.url:
             raise Exception('Параметр url не задан')
+        cache = getattr(self.__driver, 'locator_cache', None)
+        if cache is not None:
+            cache.invalidate()
         self.__driver.get(self.url)
 
     def find_element(self, *args):
@@ -269,8 +346,6 @@ class HtmlElement(object):
         self.init_args = args
         self.init_kwargs = kwargs
         self._shadow_selector = shadow_selector
-        self._target_element = None
-        self._context = None
         self._validate_params()
 
     @property
@@ -286,29 +361,55 @@ class HtmlElement(object):
                 raise Exception('UI типы должны наследоваться от WebElement')
 
     def __get__(self, obj, *args):
-        self._context = obj
-        self._search_element()
-        if self._target_element:
-            self._target_element.name = self.name
-        return self._target_element
+        # дескриптор - общий объект класса страницы: контекст и найденный элемент не сохраняются в нём, чтобы
+        # параллельные потоки не получали элементы друг друга
+        target_element = self._search_element(obj)
+        if target_element:
+            target_element.name = self.name
+        return target_element
+
+    def _find(self, search_context):
+        web_element = search_context.find_element(self.by, self.value)
+        if self._shadow_selector:
+            return web_element.shadow_root.find_element(*self._shadow_selector)
+        return web_element
+
+    def _cache_key(self, search_context):
+        # элементы верхнего уровня страницы ищутся в документе, вложенные - по id родительского элемента
+        if isinstance(search_context, WebDriverElement):
+            context_id = search_context.id
+        elif isinstance(search_context, HtmlPage) or search_context is self._driver:
+            context_id = None
+        else:
+            context_id = id(search_context)
+        return context_id, self.by, self.value, self._shadow_selector, self.ui_type
 
-    def _search_element(self, timeout=settings.implicit_wait):
+    def _search_element(self, context, timeout=settings.implicit_wait):
+        """
+        Находит элемент относительно context (страницы или родительского элемента)
+        Returns: найденный элемент или None
+        """
+        search_context = context if self.use_context else self._driver
+        cache = getattr(self._driver, 'locator_cache', None) if settings.locator_cache else None
+        key = self._cache_key(search_context) if cache is not None else None
+        if cache is not None:
+            cached_element = cache.get(key)
+            if cached_element is not None:
+                return cached_element
         try:
-            search_context = self._context if self.use_context else self._driver
-            web_element = search_context.find_element(self.by, self.value)
-            self._target_element = web_element
-
-            if self._shadow_selector:
-                self._target_element = web_element.shadow_root.find_element(*self._shadow_selector)
-
-            self._target_element.__class__ = self.ui_type
+            target_element = self._find(search_context)
+            target_element.__class__ = self.ui_type
         except (NoSuchElementException, TimeoutException):
-            self._target_element = None
             return None
-        self._target_element.is_element_present = MethodType(is_element_present, self._target_element)
+        target_element.is_element_present = MethodType(is_element_present, target_element)
 
         if len(self.init_args) or len(self.init_kwargs) > 0:
-            self._target_element.__init__(*self.init_args, **self.init_kwargs)
+            target_element.__init__(*self.init_args, **self.init_kwargs)
+
+        if cache is not None:
+            target_element._relocate = lambda: self._find(search_context)
+            cache.put(key, target_element)
+        return target_element
 
 
 class HtmlElements(HtmlElement):
@@ -320,11 +421,12 @@ class HtmlElements(HtmlElement):
         if not issubclass(self.ui_type, WebElement):
             raise Exception('HtmlElements применим только для WebElement')
 
-    def _search_element(self, timeout=settings.implicit_wait):
-        search_context = self._context if self.use_context else self._driver
-        self._target_element = WebElementsList(search_context.find_elements(self.by, self.value))
-        for index, item in enumerate(self._target_element):
+    def _search_element(self, context, timeout=settings.implicit_wait):
+        search_context = context if self.use_context else self._driver
+        target_element = WebElementsList(search_context.find_elements(self.by, self.value))
+        for index, item in enumerate(target_element):
             item.__class__ = self.ui_type
             item.name = f'{self.name} - элемент #{index}'
             item.is_element_present = MethodType(is_element_present, item)
             item.implicitly_wait = self._driver.implicitly_wait
+        return target_element
@@ -31,9 +31,11 @@ setup(name=NAME,
           'webdriver-manager>=4.0.0',
           'fsspec>=2023.6.0',
           'pixelmatch>=0.3.0',
+          'numpy>=1.21.0',
           'Pillow~=9.3.0',
           'paramiko>=3.3.1',
-          'requests>=2.31.0'
+          'requests>=2.31.0',
+          'httpx>=0.24.0'
       ],
       packages=find_packages(),
       setup_requires=['wheel'],
@@ -0,0 +1,77 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from qa_testlab.handlers.rest_api_hadler import ApiCassette, RestfullApiClient
+
+
+def _server(name: str):
+    """
+    HTTP сервер, отвечающий на GET своим именем и номером запроса
+    Returns: tuple (сервер, list путей полученных запросов)
+    """
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            received.append(self.path)
+            body = f'{name}:{len(received)}'.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, received
+
+
+@pytest.fixture
+def servers():
+    started = [_server('first'), _server('second')]
+    yield started
+    for server, _ in started:
+        server.shutdown()
+        server.server_close()
+
+
+def _client(server, cassette):
+    return RestfullApiClient(f'http://127.0.0.1:{server.server_port}', cassette=cassette)
+
+
+def test_replay_returns_recorded_response(servers, tmp_path):
+    (server, received), _ = servers
+    client = _client(server, ApiCassette(tmp_path / 'cassette.json', mode='replay'))
+
+    assert client.call_api('get', '/user', {'params': {'id': 1}}).text == 'first:1'
+    assert client.call_api('get', '/user', {'params': {'id': 1}}).text == 'first:1'
+    assert client.call_api('get', '/user', {'params': {'id': 2}}).text == 'first:2'
+    assert received == ['/user?id=1', '/user?id=2']
+
+
+def test_records_are_separated_by_host_and_port(servers, tmp_path):
+    (first, first_received), (second, second_received) = servers
+    cassette = ApiCassette(tmp_path / 'cassette.json', mode='replay')
+
+    assert _client(first, cassette).call_api('get', '/user').text == 'first:1'
+    assert _client(second, cassette).call_api('get', '/user').text == 'second:1'
+    assert _client(first, cassette).call_api('get', '/user').text == 'first:1'
+    assert first_received == ['/user']
+    assert second_received == ['/user']
+
+
+def test_replay_only_reads_saved_file(servers, tmp_path):
+    (server, received), (other, _) = servers
+    path = tmp_path / 'cassette.json'
+    _client(server, ApiCassette(path, mode='record')).call_api('get', '/user')
+
+    client = _client(server, ApiCassette(path, mode='replay_only'))
+    assert client.call_api('get', '/user').text == 'first:1'
+    assert received == ['/user']
+    with pytest.raises(LookupError):
+        _client(other, ApiCassette(path, mode='replay_only')).call_api('get', '/user')